@@ -1,19 +1,88 @@
 """A place to experiment with making pretty images"""
+import io
+import threading
+import traceback
+
 import pygame
 from pygame.rect import Rect
 
 from game_constants import *
+from sokoban_map import write_atomic
 
 from random import random
-from scipy.spatial import Delaunay
 
 class Background:
+    # Whether the background changes on its own, and so needs redrawing every frame
+    animated = False
+
     def draw(self, surf):
         pass
 
     def update(self):
         pass
 
+    def stop(self):
+        """Called when the background won't be drawn anymore"""
+        pass
+
+
+class BGThreaded(Background):
+    """Updates and draws another background on a worker thread
+
+    The worker draws the next frame into a back buffer while the game
+    blits the last finished frame.  pygame lets go of the GIL while it
+    fills and blits, so the two really do run at the same time."""
+    def __init__(self, bg, size):
+        self.bg = bg
+        self.animated = bg.animated
+        self.front = pygame.Surface(size)
+        self.back = pygame.Surface(size)
+        self.front.fill(BLACK)
+        # Held while the buffers are swapped, or the front one is drawn
+        self.lock = threading.Lock()
+        # Set when the worker should make another frame
+        self.wanted = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        # The first frame
+        self.wanted.set()
+
+    def run(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            if not self.running:
+                break
+            try:
+                self.bg.update()
+                self.bg.draw(self.back)
+            except Exception:
+                # Otherwise the thread dies quietly, and the last frame just stays up
+                print("The background stopped animating:")
+                traceback.print_exc()
+                self.running = False
+                self.animated = False
+                break
+            with self.lock:
+                self.front, self.back = self.back, self.front
+
+    def update(self):
+        # If the worker is still busy, this frame's update just gets skipped
+        if self.animated:
+            self.wanted.set()
+
+    def draw(self, surf):
+        with self.lock:
+            surf.blit(self.front, (0, 0))
+
+    def stop(self):
+        self.running = False
+        self.wanted.set()
+        # Wait for the last frame, so nothing is drawing once pygame quits
+        self.thread.join()
+        self.bg.stop()
+
 
 class BGSolid(Background):
     def __init__(self, color):
@@ -31,16 +100,37 @@ THICKNESS = 3
 
 # len(colors) >= 2
 class BGGrid(Background):
+    animated = True
+
     def __init__(self, w, h, colors):
         self.h = h
         self.w = w
         self.colors = colors
-        self.mesh = MESH_MIN + (MESH_MAX - MESH_MIN)*random()
+        # A whole number, so the grid repeats exactly every mesh pixels
+        self.mesh = int(MESH_MIN + (MESH_MAX - MESH_MIN)*random())
         self.x = 0
         self.y = 0
         self.vx = VX_MAX*(2*random() - 1)
         self.vy = VY_MAX*(2*random() - 1)
         self.thickness = THICKNESS
+        self.texture = self.make_texture()
+
+    def make_texture(self):
+        """Draw the grid once, a period larger than the screen, so drawing is just one blit"""
+        bgcolor, linecolor = self.colors[0:2]
+        tile = pygame.Surface((self.mesh, self.mesh))
+        tile.fill(bgcolor)
+        # Lines are centered on the tile's edges, so they wrap around both sides
+        for x in [0, self.mesh]:
+            pygame.draw.line(tile, linecolor, (x, 0), (x, self.mesh), self.thickness)
+        for y in [0, self.mesh]:
+            pygame.draw.line(tile, linecolor, (0, y), (self.mesh, y), self.thickness)
+        nx = self.w // self.mesh + 2
+        ny = self.h // self.mesh + 2
+        texture = pygame.Surface((nx * self.mesh, ny * self.mesh))
+        texture.blits([(tile, (i * self.mesh, j * self.mesh)) for i in range(nx) for j in range(ny)],
+                      doreturn=False)
+        return texture
 
     def update(self):
         """Make sure the base coordinates are just outside the top left"""
@@ -50,21 +140,15 @@ class BGGrid(Background):
         self.y %= self.mesh
 
     def draw(self, surf):
-        bgcolor, linecolor = self.colors[0:2]
-        surf.fill(bgcolor)
-        x, y = self.x - self.mesh, self.y - self.mesh
-        while x <= self.w + self.mesh:
-            pygame.draw.line(surf, linecolor, (x, 0), (x, self.h), self.thickness)
-            x += self.mesh
-        while y <= self.h + self.mesh:
-            pygame.draw.line(surf, linecolor, (0, y), (self.w, y), self.thickness)
-            y += self.mesh
+        surf.blit(self.texture, (self.x - self.mesh, self.y - self.mesh))
 
 
 COLOR_SHIFT = 15
 POINT_RAD = 2
 
 class BGColorChangeGrid(Background):
+    animated = True
+
     def __init__(self, h, w, color):
         self.h = h
         self.w = w
@@ -73,8 +157,11 @@ class BGColorChangeGrid(Background):
         self.hn = int(h//self.mesh + 2)
         self.xoff = 0
         self.yoff = 0
-        self.colors = {(x,y): SineColor(color, COLOR_SHIFT)
-                       for x in range(self.wn) for y in range(self.hn)}
+        # One color per cell, in column-major order
+        self.colors = OscColor(self.wn * self.hn, color, COLOR_SHIFT)
+        # The grid is drawn one pixel per cell, then scaled up
+        self.small = pygame.Surface((self.wn, self.hn))
+        self.cells = pygame.Surface((round(self.wn * self.mesh), round(self.hn * self.mesh)))
         self.x = 0
         self.y = 0
         self.vx = VX_MAX*(2*random() - 1)
@@ -107,18 +194,14 @@ class BGColorChangeGrid(Background):
                 self.yoff -= self.hn
 
     def shift_color(self):
-        for c in self.colors.values():
-            c.update()
+        self.colors.update()
 
     def draw(self, surf):
-        for i in range(self.wn):
-            i_fixed = (i + self.xoff) % self.wn
-            for j in range(self.hn):
-                j_fixed = (j + self.yoff) % self.hn
-                pygame.draw.rect(surf, self.colors[(i_fixed, j_fixed)].color(),
-                                 Rect(self.x + (i - 1)*self.mesh,
-                                      self.y + (j - 1)*self.mesh,
-                                      self.mesh + 1, self.mesh + 1), 0)
+        colors = self.colors.colors().reshape(self.wn, self.hn, 3)
+        # The cell in column i shows the color of column (i + xoff) % wn
+        pygame.surfarray.blit_array(self.small, np.roll(colors, (-self.xoff, -self.yoff), axis=(0, 1)))
+        pygame.transform.scale(self.small, self.cells.get_size(), self.cells)
+        surf.blit(self.cells, (self.x - self.mesh, self.y - self.mesh))
 
 
 COLOR_VAR = 20
@@ -151,48 +234,174 @@ def clamp_rgb(x):
     return x
 
 
-#Let's redo the SineColor class, but better, with numpy
 class OscColor:
-    """A list of colors, randomly distributed around an imput color, which oscillate in value"""
+    """A list of colors, randomly distributed around an input color, which oscillate in value
+
+    This is n SineColors at once, with everything kept in numpy arrays"""
     def __init__(self, n, color, amp):
-        self.rgb = list(color)
-        self.angle = 2*np.pi*random()
-        self.amp = amp*random()
-        self.vel = COLOR_VEL*random()/100
+        self.rgb = np.array(color, dtype=float) + COLOR_VAR*(2*np.random.rand(n, 3) - 1)
+        self.angle = 2*np.pi*np.random.rand(n)
+        self.amp = amp*np.random.rand(n)
+        self.vel = COLOR_VEL*np.random.rand(n)/100
 
     def update(self):
-        self.angle = (self.angle + self.vel) % (2*np.pi)
+        self.angle += self.vel
+        self.angle %= 2*np.pi
 
-    def color(self):
-        return tuple(clamp_rgb(c + self.amp*np.cos(self.angle)) for c in self.rgb)
+    def colors(self):
+        """An (n, 3) array of the current colors"""
+        return np.clip(self.rgb + (self.amp*np.cos(self.angle))[:, np.newaxis], 0, 255).astype(np.uint8)
 
 EDGE_BUFF = 50
+CRYSTAL_POINTS = 100
 CORNERS = np.array([[-EDGE_BUFF, -EDGE_BUFF], [WINDOW_WIDTH + EDGE_BUFF, WINDOW_HEIGHT + EDGE_BUFF],
                     [WINDOW_WIDTH + EDGE_BUFF, -EDGE_BUFF], [-EDGE_BUFF, WINDOW_HEIGHT + EDGE_BUFF]])
 
 
 class BGCrystal(Background):
-    def __init__(self, w, h, color):
+    animated = True
+
+    def __init__(self, w, h, color, cache_file=None):
         self.w = w
         self.h = h
         self.color = color
-        #self.points = np.concatenate((point_cluster_disk(300, (400, 300), 500), CORNERS)) \
-        self.points = np.concatenate((point_cluster_rect(100, -EDGE_BUFF, -EDGE_BUFF,
-                                                         WINDOW_WIDTH + 2*EDGE_BUFF,
-                                                         WINDOW_HEIGHT + 2*EDGE_BUFF), CORNERS))
-        self.tri = Delaunay(self.points).simplices
-        self.colors = [SineColor(color, COLOR_SHIFT) for t in self.tri]
+        # The points and triangles are loaded from here (or saved here, the first time)
+        self.cache_file = cache_file if cache_file is not None else crystal_cache_file(w, h)
+        # The triangulation is slow, so it waits until the background is actually used
+        self.tri = None
+
+    def build(self):
+        if not self.load_cache():
+            #self.points = np.concatenate((point_cluster_disk(300, (400, 300), 500), CORNERS)) \
+            self.points = np.concatenate((point_cluster_rect(CRYSTAL_POINTS, -EDGE_BUFF, -EDGE_BUFF,
+                                                             WINDOW_WIDTH + 2*EDGE_BUFF,
+                                                             WINDOW_HEIGHT + 2*EDGE_BUFF), CORNERS))
+            self.tri = triangulate(self.points)
+            self.save_cache()
+        self.colors = OscColor(len(self.tri), self.color, COLOR_SHIFT)
+        self.rasterize()
+
+    def load_cache(self):
+        try:
+            with np.load(self.cache_file) as data:
+                self.points, self.tri = data["points"], data["tri"]
+        except Exception:
+            # Missing, truncated or otherwise unreadable; it's made again and overwritten
+            return False
+        return True
+
+    def save_cache(self):
+        file = io.BytesIO()
+        np.savez(file, points=self.points, tri=self.tri)
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            write_atomic(self.cache_file, file.getvalue())
+        except OSError as e:
+            print(f"Couldn't save the triangulation: {e}")
+
+    def rasterize(self):
+        """Find which triangle covers each pixel, once, so that drawing is just a color lookup
+
+        index[x, y] is 0 for black, 1 for a point, and 2 + i for triangle i"""
+        surf = pygame.Surface((self.w, self.h))
+        surf.fill(BLACK)
+        for p in self.points:
+            pygame.draw.circle(surf, index_color(1), p, POINT_RAD, 0)
+        for i in range(len(self.tri)):
+            pygame.draw.polygon(surf, index_color(2 + i), [self.points[j] for j in self.tri[i]], 0)
+        rgb = pygame.surfarray.array3d(surf).astype(np.int32)
+        self.index = (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+        self.palette = np.zeros((len(self.tri) + 2, 3), dtype=np.uint8)
+        self.palette[1] = self.color
+        if len(self.palette) <= 256:
+            # An 8 bit surface does the color lookup for us, while it's blitted
+            self.image = pygame.Surface((self.w, self.h), depth=8)
+            pygame.surfarray.blit_array(self.image, self.index.astype(np.uint8))
+        else:
+            self.image = pygame.Surface((self.w, self.h))
 
     def update(self):
-        for c in self.colors:
-            c.update()
+        if self.tri is None:
+            self.build()
+        self.colors.update()
 
     def draw(self, surf):
-        surf.fill(BLACK)
-        for p in self.points:
-            pygame.draw.circle(surf, self.color, p, POINT_RAD, 0)
-        for i in range(len(self.tri)):
-            pygame.draw.polygon(surf, self.colors[i].color(), [self.points[j] for j in self.tri[i]], 0)
+        if self.tri is None:
+            self.build()
+        self.palette[2:] = self.colors.colors()
+        if self.image.get_bitsize() == 8:
+            self.image.set_palette(self.palette.tolist())
+        else:
+            pygame.surfarray.blit_array(self.image, self.palette[self.index])
+        surf.blit(self.image, (0, 0))
+
+
+def crystal_cache_file(w, h):
+    """Where a crystal of this size keeps its triangulation, between runs"""
+    return os.path.join(CACHE_DIR, f"crystal_{w}x{h}_{CRYSTAL_POINTS}.npz")
+
+
+def index_color(i):
+    """Encode a number as an RGB color"""
+    return (i >> 16) & 255, (i >> 8) & 255, i & 255
+
+
+def triangulate(points):
+    """Return the Delaunay triangulation of points, as an array of triples of indices
+
+    scipy is only imported when it's needed, and it's optional"""
+    try:
+        from scipy.spatial import Delaunay
+    except ImportError:
+        return bowyer_watson(points)
+    return Delaunay(points).simplices
+
+
+def circumcircles(verts, tris):
+    """Return the centers and squared radii of the circumcircles of triangles"""
+    a, b, c = verts[tris[:, 0]], verts[tris[:, 1]], verts[tris[:, 2]]
+    d = 2 * (a[:, 0]*(b[:, 1] - c[:, 1]) + b[:, 0]*(c[:, 1] - a[:, 1]) + c[:, 0]*(a[:, 1] - b[:, 1]))
+    aa, bb, cc = (a**2).sum(axis=1), (b**2).sum(axis=1), (c**2).sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ux = (aa*(b[:, 1] - c[:, 1]) + bb*(c[:, 1] - a[:, 1]) + cc*(a[:, 1] - b[:, 1])) / d
+        uy = (aa*(c[:, 0] - b[:, 0]) + bb*(a[:, 0] - c[:, 0]) + cc*(b[:, 0] - a[:, 0])) / d
+    centers = np.stack((ux, uy), axis=1)
+    return centers, ((a - centers)**2).sum(axis=1)
+
+
+def bowyer_watson(points):
+    """A plain numpy Delaunay triangulation, for when scipy isn't installed
+
+    Points are added one at a time; the triangles whose circumcircles contain
+    the new point are replaced by a fan of triangles around it"""
+    points = np.asarray(points, dtype=float)
+    # Repeated points would make degenerate triangles
+    _, unique = np.unique(points, axis=0, return_index=True)
+    n = len(points)
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    span = max(hi - lo) + 1
+    cx, cy = (lo + hi) / 2
+    # Start with one triangle which is big enough to hold every point
+    verts = np.concatenate((points, [[cx - 2000*span, cy - 1000*span],
+                                     [cx + 2000*span, cy - 1000*span],
+                                     [cx, cy + 2000*span]]))
+    tris = np.array([[n, n + 1, n + 2]])
+    centers, radii = circumcircles(verts, tris)
+    for i in sorted(unique):
+        bad = ((centers - verts[i])**2).sum(axis=1) < radii
+        # The edges on the outside of the hole are those in only one bad triangle
+        edges = {}
+        for a, b, c in tris[bad]:
+            for edge in [(a, b), (b, c), (c, a)]:
+                key = tuple(sorted(edge))
+                edges[key] = edges.get(key, 0) + 1
+        new = np.array([[a, b, i] for (a, b), count in edges.items() if count == 1]).reshape(-1, 3)
+        new_centers, new_radii = circumcircles(verts, new)
+        tris = np.concatenate((tris[~bad], new))
+        centers = np.concatenate((centers[~bad], new_centers))
+        radii = np.concatenate((radii[~bad], new_radii))
+    # Throw out the triangles which use the starting triangle's corners
+    return tris[(tris < n).all(axis=1)]
 
 
 def point_cluster_rect(n, x, y, w, h):
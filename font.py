@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 import pygame
 
 pygame.font.init()
@@ -5,3 +7,44 @@ pygame.font.init()
 FONT_LARGE = pygame.font.Font(pygame.font.match_font('consolas', bold=True), 60)
 FONT_MEDIUM = pygame.font.Font(pygame.font.match_font('consolas', bold=True), 36)
 FONT_SMALL = pygame.font.Font(pygame.font.match_font('consolas', bold=True), 16)
+
+# How many rendered pieces of text to keep around
+TEXT_CACHE_SIZE = 256
+
+
+class TextCache:
+    """Remembers the most recently rendered text, since rendering it is slow
+
+    The least recently used surface is thrown out once the cache is full"""
+    def __init__(self, size=TEXT_CACHE_SIZE):
+        self.size = size
+        self.surfaces = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        surf = self.surfaces.get(key)
+        if surf is not None:
+            self.hits += 1
+            self.surfaces.move_to_end(key)
+            return surf
+        self.misses += 1
+        surf = font.render(text, antialias, color)
+        self.surfaces[key] = surf
+        if len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surf
+
+    def clear(self):
+        self.surfaces.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+TEXT_CACHE = TextCache()
+
+
+def render_text(font, text, color, antialias=True):
+    """Like font.render(), but cached; don't draw on the surface you get back!"""
+    return TEXT_CACHE.render(font, text, color, antialias)
@@ -0,0 +1,67 @@
+"""Paces the main loop
+
+Game logic runs at a fixed timestep of FPS updates per second, however long
+drawing takes; if the loop falls behind it runs several updates before the
+next draw, up to MAX_CATCH_UP_TICKS."""
+
+import time
+from collections import deque
+
+from game_constants import *
+
+NS_PER_MS = 1000000
+NS_PER_SEC = 1000000000
+
+
+class FrameClock:
+    def __init__(self, fps=FPS):
+        self.fps = fps
+        # Length of one update, in ns
+        self.step = NS_PER_SEC // fps
+        # When the next update is due
+        self.next_tick = time.perf_counter_ns()
+        # When the last frame started, and the time between the last few frames
+        self.last_frame = None
+        self.intervals = deque(maxlen=fps)
+        # How many updates were skipped because the game fell too far behind
+        self.dropped = 0
+
+    def wait(self):
+        """Sleep until the next update is due
+
+        time.sleep() can oversleep by a millisecond or more, so the last
+        FRAME_SPIN_TIME ms are spent spinning instead"""
+        remaining = self.next_tick - time.perf_counter_ns()
+        if remaining > FRAME_SPIN_TIME * NS_PER_MS:
+            time.sleep((remaining - FRAME_SPIN_TIME * NS_PER_MS) / NS_PER_SEC)
+        while time.perf_counter_ns() < self.next_tick:
+            pass
+
+    def ticks(self):
+        """Return the number of updates due before the next frame is drawn"""
+        now = time.perf_counter_ns()
+        if self.last_frame is not None:
+            self.intervals.append(now - self.last_frame)
+        self.last_frame = now
+        if now < self.next_tick:
+            return 0
+        due = (now - self.next_tick) // self.step + 1
+        if due > MAX_CATCH_UP_TICKS:
+            # Running every missed update would only put us further behind
+            self.dropped += due - MAX_CATCH_UP_TICKS
+            self.next_tick = now + self.step
+            return MAX_CATCH_UP_TICKS
+        self.next_tick += due * self.step
+        return due
+
+    def real_fps(self):
+        """The number of frames actually drawn per second, lately"""
+        if not self.intervals:
+            return 0.0
+        return NS_PER_SEC * len(self.intervals) / sum(self.intervals)
+
+    def jitter(self):
+        """The mean difference between a frame's length and what it should be, in ms"""
+        if not self.intervals:
+            return 0.0
+        return sum(abs(dt - self.step) for dt in self.intervals) / len(self.intervals) / NS_PER_MS
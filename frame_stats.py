@@ -0,0 +1,164 @@
+"""Timing of each phase of a frame, for finding out where the time goes"""
+
+import csv
+import os
+import time
+
+import numpy as np
+import pygame
+
+from font import FONT_SMALL, render_text
+from game_constants import *
+
+# The phases of a frame, in the order they happen
+PHASES = ["check_for_quit", "pre_update", "handle_input", "update", "draw", "display", "tk"]
+PHASE_INDEX = {phase: i for i, phase in enumerate(PHASES)}
+PERCENTILES = [50, 95, 99]
+
+OVERLAY_BG = (0, 0, 0, 180)
+OVERLAY_PADDING = 4
+
+
+class FrameStats:
+    """Keeps the time spent in each phase over the last few frames, in ms
+
+    The times live in a ring buffer; each frame is tagged with the name of
+    the state that was in control at the end of it."""
+    def __init__(self, size=STATS_FRAMES):
+        self.size = size
+        self.times = np.zeros((size, len(PHASES)))
+        self.states = [None] * size
+        # The number of frames recorded so far, including ones since overwritten
+        self.count = 0
+        self.current = np.zeros(len(PHASES))
+        self.last = time.perf_counter_ns()
+
+    def begin(self):
+        """Start timing a new frame"""
+        self.current[:] = 0
+        self.last = time.perf_counter_ns()
+
+    def lap(self, phase):
+        """Add the time since the last lap to the given phase
+
+        A phase can happen more than once in a frame, like when the game is
+        catching up on updates."""
+        now = time.perf_counter_ns()
+        self.current[PHASE_INDEX[phase]] += (now - self.last) / 1000000
+        self.last = now
+
+    def end(self, state):
+        row = self.count % self.size
+        self.times[row] = self.current
+        self.states[row] = type(state).__name__
+        self.count += 1
+
+    def order(self):
+        """The rows of the ring buffer that are in use, oldest first"""
+        n = min(self.count, self.size)
+        return (self.count - n + np.arange(n)) % self.size
+
+    def percentiles(self):
+        """Return an array of the PERCENTILES of each phase, plus the whole frame
+
+        The result has one row for each percentile and one column for each
+        phase, with the total last."""
+        times = self.times[self.order()]
+        if not len(times):
+            return np.zeros((len(PERCENTILES), len(PHASES) + 1))
+        times = np.column_stack((times, times.sum(axis=1)))
+        return np.percentile(times, PERCENTILES, axis=0)
+
+    def report(self):
+        """A table of the percentiles of each phase, as text"""
+        table = self.percentiles()
+        lines = ["{:<15}".format("") + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES)]
+        lines += ["{:<15}".format(name) + "".join(f"{t:9.3f}" for t in table[:, i])
+                  for i, name in enumerate(PHASES + ["total"])]
+        return "\n".join(lines)
+
+    def export(self, directory=STATS_DIR):
+        """Write the recorded frames to a new CSV file, and return its name"""
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, time.strftime("frames_%Y%m%d_%H%M%S.csv"))
+        with open(filename, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["frame", "state"] + PHASES + ["total"])
+            first = self.count - len(self.order())
+            for frame, row in enumerate(self.order(), first):
+                times = self.times[row]
+                writer.writerow([frame, self.states[row]] + [f"{t:.3f}" for t in times] + [f"{times.sum():.3f}"])
+        return filename
+
+
+class StatsOverlay:
+    """Shows a FrameStats' percentiles in the corner of the window
+
+    Text is only rendered again every half second, so it stays readable.
+    The overlay remembers what was under it, and puts that back once the
+    frame has been shown, so states can keep drawing only what changed."""
+    def __init__(self, stats, pos=(0, 0)):
+        self.stats = stats
+        self.pos = pos
+        self.visible = False
+        self.image = None
+        self.under = None
+        self.frames = 0
+        # Where the overlay was last shown, once it's been hidden
+        self.erase = None
+
+    def toggle(self):
+        if self.visible and self.image is not None:
+            self.erase = self.rect()
+        self.visible = not self.visible
+        self.image = None
+        self.frames = 0
+
+    def rect(self):
+        return self.image.get_rect(topleft=self.pos)
+
+    def render(self, state):
+        table = self.stats.percentiles()
+        rows = [[type(state).__name__] + [f"p{p}" for p in PERCENTILES]]
+        rows += [[name] + [f"{t:.2f}" for t in table[:, i]] for i, name in enumerate(PHASES + ["total"])]
+        cells = [[render_text(FONT_SMALL, text, WHITE) for text in row] for row in rows]
+        # Columns are lined up by hand, since the font might not be monospaced
+        widths = [max(row[i].get_width() for row in cells) + 2*OVERLAY_PADDING for i in range(len(rows[0]))]
+        height = FONT_SMALL.get_linesize()
+        self.image = pygame.Surface((sum(widths), height * len(rows) + 2*OVERLAY_PADDING), SRCALPHA)
+        self.image.fill(OVERLAY_BG)
+        blits = []
+        for i, row in enumerate(cells):
+            y = OVERLAY_PADDING + height * i
+            blits.append((row[0], (OVERLAY_PADDING, y)))
+            # The numbers are right aligned
+            x = widths[0]
+            for width, cell in zip(widths[1:], row[1:]):
+                x += width
+                blits.append((cell, (x - OVERLAY_PADDING - cell.get_width(), y)))
+        self.image.blits(blits, doreturn=False)
+
+    def draw(self, surf, state, drawn):
+        """Draw the overlay on top of the frame, returning its rect,
+        or None if neither it nor anything under it changed"""
+        if not self.visible:
+            rect, self.erase = self.erase, None
+            return rect
+        self.frames += 1
+        stale = self.image is None or self.frames % max(1, FPS // 2) == 0
+        if not drawn and not stale:
+            return None
+        # If the overlay shrinks, the window still shows the edge of the old one
+        shown = self.rect() if self.image is not None else None
+        if stale:
+            self.render(state)
+        rect = self.rect().clip(surf.get_rect())
+        self.under = (surf.subsurface(rect).copy(), rect.topleft)
+        surf.blit(self.image, self.pos)
+        return rect if shown is None else rect.union(shown)
+
+    def restore(self, surf):
+        """Put back what the overlay was drawn over"""
+        if self.under is not None:
+            surf.blit(*self.under)
+            self.under = None
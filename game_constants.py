@@ -13,6 +13,10 @@ DEBUG = True
 # System Constants
 FPS = 30
 FRAME_TIME = 1000.0 / FPS
+# If the game falls this many updates behind, it gives up on catching up
+MAX_CATCH_UP_TICKS = 5
+# The main loop sleeps until this long before the next frame, then spins, in ms
+FRAME_SPIN_TIME = 2
 
 WINDOW_WIDTH = 800
 WINDOW_HEIGHT = 600
@@ -22,6 +26,28 @@ MAPS_DIR = os.path.join(MAIN_DIR, "maps")
 TEMP_MAP_FILE = os.path.join(MAPS_DIR, "__temp.mapx")
 DEFAULT_MAP_FILE = os.path.join(MAPS_DIR, "__default.mapx")
 
+# Editor crash recovery
+# Kept apart from the maps, so tools that read every map don't pick these up
+AUTOSAVE_DIR = os.path.join(MAIN_DIR, "autosave")
+AUTOSAVE_JOURNAL_FILE = os.path.join(AUTOSAVE_DIR, "__autosave.journal")
+AUTOSAVE_MAP_PREFIX = "__autosave_"
+# How many edits to journal before folding them into a full map
+AUTOSAVE_COMPACT_RECORDS = 500
+
+# Things that are slow to make, kept between runs
+CACHE_DIR = os.path.join(MAIN_DIR, "cache")
+
+# Frame timing
+# How many frames of timings to keep
+STATS_FRAMES = 600
+STATS_OVERLAY_KEY = K_F3
+STATS_EXPORT_KEY = K_F4
+STATS_DIR = os.path.join(MAIN_DIR, "stats")
+PROFILE_KEY = K_F5
+PROFILE_DIR = os.path.join(MAIN_DIR, "profiles")
+# How many functions to list in a profile's summary
+PROFILE_TOP = 30
+
 # I/O
 FILE_CHUNK_SIZE = 4096
 
@@ -34,6 +60,10 @@ MB_LEFT = 1
 MB_MIDDLE = 2
 MB_RIGHT = 3
 MOUSE_BUTTONS = [1,2,3]
+# These are the only events we care about handling
+HANDLED_EVENTS = [KEYUP, KEYDOWN, MOUSEBUTTONDOWN, ACTIVEEVENT]
+# When one of these comes, the window has lost what it was showing
+WINDOW_SHOWN_EVENTS = [VIDEOEXPOSE, WINDOWEXPOSED, WINDOWRESTORED]
 
 # Sokoban Specific Constants
 
@@ -61,6 +91,14 @@ DISPLAY_CY = (DISPLAY_HEIGHT - 1)//2
 
 EDITOR_RECT = Rect(EDIT_PADDING, EDIT_PADDING, DISPLAY_WIDTH*MESH, DISPLAY_HEIGHT*MESH)
 
+# The spot sizes the board can be zoomed to; each one fits the board exactly
+ZOOM_MESHES = [MESH, 15, 10, 6]
+ZOOM_KEYS = {K_EQUALS: -1, K_MINUS: 1}
+MINIMAP_KEY = K_m
+# The length of the minimap's longer side, and its distance from the board's corner
+MINIMAP_SIZE = 160
+MINIMAP_MARGIN = 8
+
 # Colors
 DIM_FILTER = (0, 0, 0, 50)
 
@@ -89,6 +127,8 @@ SW_GREEN1 = (200, 240, 180)
 SW_PURPLE1 = (220, 180, 250)
 
 OUT_OF_BOUNDS_COLOR = LIGHT_BLUE
+MINIMAP_BORDER_COLOR = NAVY_BLUE
+MINIMAP_CAMERA_COLOR = HOT_PINK
 
 class ColorEnum(Enum):
     Black = BLACK
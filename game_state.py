@@ -1,7 +1,5 @@
 """Abstract base class for game states"""
 
-import pygame
-
 from game_constants import *
 from widget import Root
 
@@ -10,32 +8,57 @@ class GameState:
     def __init__(self, mgr, parent=None):
         # We always need a reference to the manager, so we can switch states
         self.mgr = mgr
-        # Upon creation, a state becomes the current state
-        # If this behavior is not wanted, overwrite it in the subclass constructor
-        self.take_control()
+        mgr.start_switch()
         # Parent is the state that we came from
         self.parent = parent
         # The widget
         self.root = Root()
-        # Each gamestate has its own surface to print to
-        self.surf = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.HWSURFACE | pygame.DOUBLEBUF)
-        pass
+        # Every state draws to the window, which belongs to the manager
+        self.surf = mgr.surf
+        # What the window showed when a child state took over from this one
+        self.frame = None
+        # Upon creation, a state becomes the current state
+        # If this behavior is not wanted, overwrite it in the subclass constructor
+        self.take_control()
 
     def pre_update(self):
         pass
 
-    def handle_input(self):
-        self.root.handle_input()
-        pygame.event.clear()
+    def handle_input(self, events):
+        """Respond to this frame's events; the widgets get the first chance at each one"""
+        for event in events:
+            # Once another state takes over, the rest of the input isn't for us
+            if self.mgr.state is not self:
+                break
+            if not self.root.handle_event(event):
+                self.handle_event(event)
+
+    def handle_event(self, event):
+        """Respond to an event that none of the widgets used"""
+        pass
 
     def update(self):
         self.root.update()
 
+    def mark_dirty(self, *args):
+        """Something on screen changed, so the state has to be drawn next frame"""
+        self.dirty = True
+
+    def animated(self):
+        """Whether the state changes by itself, without being marked dirty"""
+        return self.root.animated()
+
     def draw(self):
+        """Draw the state to its surface
+
+        A state may return a list of the Rects it changed, so that only those
+        parts of the window get updated.  Returning None updates everything."""
         self.root.draw(self.surf)
 
     def quit(self):
         """Perform any necessary clean-up before leaving a state for good"""
+        if self.root.bg is not None:
+            self.root.bg.stop()
         self.parent.reinit()
 
     def reinit(self):
@@ -44,11 +67,28 @@ class GameState:
 
     def take_control(self):
         """Become the current state"""
+        previous = self.mgr.state
+        if previous is not None and previous is self.parent:
+            previous.suspend()
+        elif previous is not None and previous.parent is self:
+            self.resume()
         self.mgr.state = self
+        self.mark_dirty()
+
+    def suspend(self):
+        """Remember the last frame, for when a child state takes over"""
+        self.frame = self.surf.copy()
+
+    def resume(self):
+        """Put the last frame back in the window when a child state returns control"""
+        if self.frame is not None:
+            self.surf.blit(self.frame, (0, 0))
+            self.frame = None
 
     def previous_state(self):
         """Return control to the current state's parent state."""
         if self.parent is not None:
+            self.mgr.start_switch()
             self.quit()
             self.parent.take_control()
         # If we were already at the top of the state stack, just quit
@@ -31,33 +31,32 @@ class GSColorSelect(GameState):
         self.set_text()
         self.font = pygame.font.Font(pygame.font.match_font('consolas', bold=True), 20)
 
-    def handle_input(self):
-        for event in pygame.event.get():
-            if event.type == MOUSEMOTION:
-                x, y = pygame.mouse.get_pos()
-                if LEFT <= x < LEFT + WIDTH and TOP <= y < TOP + HEIGHT:
-                    self.x = x
-                    self.y = y
-                    self.get_current_color()
-            elif event.type == KEYDOWN:
-                if event.key == K_UP:
-                    self.sat = min(self.sat + DSAT_L, 256)
-                    self.color_panel.draw_once(self.sat)
-                    self.get_current_color()
-                elif event.key == K_DOWN:
-                    self.sat = max(self.sat - DSAT_L, 0)
-                    self.color_panel.draw_once(self.sat)
-                    self.get_current_color()
-                elif event.key == K_RIGHT:
-                    self.sat = min(self.sat + DSAT, 256)
-                    self.color_panel.draw_once(self.sat)
-                    self.get_current_color()
-                elif event.key == K_LEFT:
-                    self.sat = max(self.sat - DSAT, 0)
-                    self.color_panel.draw_once(self.sat)
-                    self.get_current_color()
-                elif event.key == K_RETURN:
-                    self.mgr.previous_state()
+    def handle_event(self, event):
+        if event.type == MOUSEMOTION:
+            x, y = event.pos
+            if LEFT <= x < LEFT + WIDTH and TOP <= y < TOP + HEIGHT:
+                self.x = x
+                self.y = y
+                self.get_current_color()
+        elif event.type == KEYDOWN:
+            if event.key == K_UP:
+                self.sat = min(self.sat + DSAT_L, 256)
+                self.color_panel.draw_once(self.sat)
+                self.get_current_color()
+            elif event.key == K_DOWN:
+                self.sat = max(self.sat - DSAT_L, 0)
+                self.color_panel.draw_once(self.sat)
+                self.get_current_color()
+            elif event.key == K_RIGHT:
+                self.sat = min(self.sat + DSAT, 256)
+                self.color_panel.draw_once(self.sat)
+                self.get_current_color()
+            elif event.key == K_LEFT:
+                self.sat = max(self.sat - DSAT, 0)
+                self.color_panel.draw_once(self.sat)
+                self.get_current_color()
+            elif event.key == K_RETURN:
+                self.mgr.previous_state()
 
     def get_current_color(self):
         pixels = pygame.PixelArray(self.surf)
@@ -101,10 +100,12 @@ class ColorChooser(Panel):
                 lum = self.lum[y]
                 pixels[x][y] = (r * lum, g * lum, b * lum)
         del pixels
+        self.dirty = True
 
     # Override the superclass method so that we're not repainting the surface black every frame
     def draw(self, surf):
         surf.blit(self.surf, self.pos)
+        self.dirty = False
 
 
 def get_hue(x, size):
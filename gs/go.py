@@ -39,13 +39,16 @@ class GSGo(GameState):
             pygame.draw.circle(self.hover[color], (*PIECE_COLOR[color], 128),
                                (HALF_MESH, HALF_MESH), PIECE_SIZE)
 
-    def handle_input(self):
-        for event in pygame.event.get():
-            if event.type == MOUSEBUTTONDOWN:
-                pos = self.mouse_pos(event.pos)
-                if pos is not None:
-                    if event.button == MB_LEFT:
-                        self.try_move(pos)
+    def handle_event(self, event):
+        if event.type == MOUSEBUTTONDOWN:
+            pos = self.mouse_pos(event.pos)
+            if pos is not None:
+                if event.button == MB_LEFT:
+                    self.try_move(pos)
+
+    # The hover piece follows the mouse, which doesn't send events
+    def animated(self):
+        return True
 
     def draw(self):
         super().draw()
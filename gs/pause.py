@@ -1,6 +1,6 @@
 import pygame
 
-from font import FONT_MEDIUM
+from font import FONT_LARGE, FONT_MEDIUM, render_text
 from game_constants import *
 from game_state import GameState
 from widget import Menu
@@ -21,10 +21,14 @@ class GSPause(GameState):
         self.frames = (self.frames + 1) % (GSPause.FLICKER * 2)
 
     def draw(self):
-        self.surf.blit(self.parent.surf, (0, 0))
+        # If the parent was suspended, its last frame is still good
+        if self.parent.frame is not None:
+            self.surf.blit(self.parent.frame, (0, 0))
+        else:
+            self.parent.draw()
         # We can have a cute flashing on the pause screen!! Very optional
         if not self.flicker or self.frames < GSPause.FLICKER:
-            self.surf.blit(self.font.render("PAUSED", True, (100,100,0)), (325, 250))
+            self.surf.blit(render_text(self.font, "PAUSED", (100,100,0)), (325, 250))
         super().draw()
 
 
@@ -36,4 +40,4 @@ class PauseMenu(Menu):
         self.color_def = NAVY_BLUE
         self.color_high = GOLD
         self.height = 80
-        self.font = pygame.font.Font(pygame.font.match_font('consolas', bold=True), 60)
\ No newline at end of file
+        self.font = FONT_LARGE
\ No newline at end of file
@@ -1,10 +1,12 @@
 from collections import deque
 from tkinter import filedialog, messagebox
 
-from background import BGCrystal, BGSolid
+from background import BGSolid
 from delta import Delta
 from game_state import GameState
+from sokoban_map import MapSaver, MapSnapshot, decode_map, group_objs
 from sokoban_obj import *
+from sokoban_render import BoardRenderer
 from sokoban_str import *
 
 
@@ -18,7 +20,7 @@ class Camera(IntEnum):
 # The value is the object at that position on that layer, or None
 
 class GSSokoban(GameState):
-    def __init__(self, mgr, parent, pick_level=False, testing=False, editing=False):
+    def __init__(self, mgr, parent, pick_level=False, testing=False, editing=False, filename=None):
         super().__init__(mgr, parent)
         self.root.set_bg(BGSolid(LAVENDER))
         self.cam_mode = Camera.FOLLOW_PLAYER
@@ -29,9 +31,18 @@ class GSSokoban(GameState):
         self.deltas = deque(maxlen=MAX_DELTAS)
         self.bg = WHITE
         self.player = None
-        if pick_level:
-            filename = None
-        else:
+        self.saver = MapSaver()
+        # The size of a spot, and how many fit on the board, at the current zoom
+        self.zoom = 0
+        self.mesh = MESH
+        self.view_w = DISPLAY_WIDTH
+        self.view_h = DISPLAY_HEIGHT
+        self.renderer = BoardRenderer(self)
+        self.show_minimap = False
+        # Whether the whole window has to be drawn next frame
+        self.repaint = True
+        # With no file to load, we ask the player to pick one
+        if filename is None and not pick_level:
             filename = TEMP_MAP_FILE if testing else DEFAULT_MAP_FILE
         if not self.load(filename=filename, editing=editing):
             self.previous_state()
@@ -45,35 +56,79 @@ class GSSokoban(GameState):
     def update_camera(self):
         if self.cam_mode == Camera.FOLLOW_PLAYER:
             px, py = self.player.pos
-            if self.w < DISPLAY_WIDTH:
-                self.camx = (self.w - DISPLAY_WIDTH) // 2
-                self.camxoff = MESH //2 if ((self.w - DISPLAY_WIDTH) % 2) else 0
+            if self.w < self.view_w:
+                self.camx = (self.w - self.view_w) // 2
+                self.camxoff = self.mesh //2 if ((self.w - self.view_w) % 2) else 0
             else:
-                self.camx = min(max(0, px - DISPLAY_CX), self.w - DISPLAY_WIDTH)
+                self.camx = min(max(0, px - (self.view_w - 1)//2), self.w - self.view_w)
                 self.camxoff = 0
-            if self.h < DISPLAY_HEIGHT:
-                self.camy = (self.h - DISPLAY_HEIGHT) // 2
-                self.camyoff = MESH //2 if ((self.h - DISPLAY_HEIGHT) % 2) else 0
+            if self.h < self.view_h:
+                self.camy = (self.h - self.view_h) // 2
+                self.camyoff = self.mesh //2 if ((self.h - self.view_h) % 2) else 0
             else:
-                self.camy = min(max(0, py - DISPLAY_CY), self.h - DISPLAY_HEIGHT)
+                self.camy = min(max(0, py - (self.view_h - 1)//2), self.h - self.view_h)
                 self.camyoff = 0
 
+    def set_zoom(self, zoom):
+        """Zoom to one of the ZOOM_MESHES, keeping the center of the view in place"""
+        zoom = min(max(0, zoom), len(ZOOM_MESHES) - 1)
+        cx, cy = self.camx + self.view_w // 2, self.camy + self.view_h // 2
+        self.zoom = zoom
+        self.mesh = ZOOM_MESHES[zoom]
+        self.view_w = DISPLAY_WIDTH * MESH // self.mesh
+        self.view_h = DISPLAY_HEIGHT * MESH // self.mesh
+        self.camx, self.camy = cx - self.view_w // 2, cy - self.view_h // 2
+        self.renderer.set_mesh(self.mesh)
+        self.update_camera()
+
+    def handle_view_key(self, key):
+        """Zoom or toggle the minimap; returns whether the key did either"""
+        if key in ZOOM_KEYS:
+            self.set_zoom(self.zoom + ZOOM_KEYS[key])
+        elif key == MINIMAP_KEY:
+            self.show_minimap = not self.show_minimap
+            self.repaint = True
+        else:
+            return False
+        return True
+
     def draw(self):
-        super().draw()
-        self.draw_room()
+        if self.repaint:
+            super().draw()
+            self.draw_room()
+            self.repaint = False
+            return None
+        # The rest of the window doesn't change, so only the board needs updating
+        rects = self.renderer.draw(self.surf)
+        if self.show_minimap and (rects or self.renderer.minimap.stale()):
+            rects.append(self.draw_minimap())
+        return rects
+
+    def reinit(self):
+        # Draw everything again when a child state returns control, rather
+        # than trusting that the copy of the last frame is still right
+        self.repaint = True
 
     def pre_update(self):
         self.delta = Delta()
 
-    def handle_input(self):
+    def handle_input(self, events):
         self.input_key = None
-        for event in pygame.event.get(KEYDOWN):
-            if event.type == KEYDOWN:
-                if event.key in INPUT_KEYS:
-                    self.input_key = event.key
-                    break
+        super().handle_input(events)
+
+    def handle_event(self, event):
+        if event.type == KEYDOWN:
+            if self.handle_view_key(event.key):
+                return
+            # Only the first move of a frame counts
+            if event.key in INPUT_KEYS and self.input_key is None:
+                self.input_key = event.key
+        elif event.type in WINDOW_SHOWN_EVENTS:
+            # Most frames only show the board, so the whole window has to be shown again
+            self.repaint = True
 
     def update(self):
+        self.saver.check_q()
         input = self.input_key
         # Don't save a Delta at all unless the player Did Something
         if input is not None:
@@ -89,6 +144,7 @@ class GSSokoban(GameState):
                 if moved:
                     self.apply_delta()
                     self.deltas.append(self.delta)
+            self.renderer.mark_delta(self.delta)
         self.update_camera()
 
     def apply_delta(self):
@@ -231,35 +287,64 @@ class GSSokoban(GameState):
         if camera:
             x -= self.camx
             y -= self.camy
-        return x * MESH + self.padx, y * MESH + self.pady
+        return x * self.mesh + self.padx, y * self.mesh + self.pady
 
     def grid_pos(self, x, y):
-        return ((x - self.padx) // MESH) + self.camx, ((y - self.pady) // MESH) + self.camy
+        return ((x - self.padx) // self.mesh) + self.camx, ((y - self.pady) // self.mesh) + self.camy
 
     def draw_room(self):
-        pygame.draw.rect(self.surf, WHITE, Rect(self.padx, self.pady, MESH * DISPLAY_WIDTH, MESH * DISPLAY_HEIGHT))
-        for layer in Layer:
-            self.draw_layer(layer)
-        self.draw_out_of_bounds()
-
-    def draw_layer(self, layer):
-        for i in range(DISPLAY_WIDTH):
-            for j in range(DISPLAY_HEIGHT):
-                pos = (i + self.camx, j + self.camy)
-                if self.in_bounds(pos):
-                    obj = self.objmap[pos][layer]
-                    if obj is not None:
-                        obj.draw(self.surf, self.real_pos(pos))
-
-    def draw_out_of_bounds(self):
-        for i in range(DISPLAY_WIDTH):
-            for j in range(DISPLAY_HEIGHT):
-                pos = (i + self.camx, j + self.camy)
-                if not self.in_bounds(pos):
-                    pygame.draw.rect(self.surf, OUT_OF_BOUNDS_COLOR,
-                                     Rect(self.real_pos(pos), (MESH, MESH)), 0)
-
-    def save(self, filename=None):
+        self.renderer.draw_all(self.surf)
+        if self.show_minimap:
+            self.draw_minimap()
+
+    def draw_minimap(self):
+        """Draw the minimap in the top right corner of the board, and return where it went"""
+        minimap = self.renderer.minimap
+        w, h = minimap.size
+        pos = (self.padx + DISPLAY_WIDTH * MESH - w - MINIMAP_MARGIN, self.pady + MINIMAP_MARGIN)
+        return minimap.draw(self.surf, pos)
+
+    def renumber(self):
+        """Give the saved objects IDs in the order they'll be written
+
+        Afterwards the object table holds exactly the objects that get saved.
+        Objects keep their relative order, so renumbering a room that was
+        just loaded gives every object the same ID."""
+        objs = []
+        for x in range(self.w):
+            for y in range(self.h):
+                for obj in self.objmap[(x, y)]:
+                    if obj is not None and OBJ_TYPE[obj.name()]["save"]:
+                        objs.append(obj)
+        objs.sort(key=lambda obj: (obj.id is None, obj.id or 0))
+        # Objects left outside the room by a resize aren't saved anymore
+        for obj in self.objtable:
+            if obj is not None:
+                obj.id = None
+        self.objtable = group_objs(objs, key=lambda obj: (obj.name(), obj.args()))
+        for i, obj in enumerate(self.objtable):
+            obj.id = i
+
+    def snapshot(self):
+        """Copy out the parts of the room that get saved
+
+        The IDs in the snapshot are the objects' current ones, so call
+        renumber() first."""
+        # Structures can't refer to objects that aren't saved
+        # (and a structure left with nothing to link is dropped)
+        saved = set(map(id, self.objtable))
+        structures = [s.pack(saved) for s in self.structures]
+        return MapSnapshot(self.w, self.h,
+                           [(obj.name(), obj.args(), obj.pos) for obj in self.objtable],
+                           self.player.pos, [s for s in structures if s is not None])
+
+    def add_to_table(self, obj):
+        """Give obj the next ID in this room"""
+        obj.id = len(self.objtable)
+        self.objtable.append(obj)
+
+    def save(self, filename=None, callback=None):
+        """Save the room in the background; callback(filename, error) runs when it's done"""
         if self.player is None:
             if not self.search_for_player():
                 messagebox.showinfo("Warning", "The map must have a player object")
@@ -270,44 +355,8 @@ class GSSokoban(GameState):
             return False
         if filename.split(".")[-1] not in ["map", "mapx"]:
             filename += ".map"
-        try:
-            with open(filename, "w+b") as file:
-                # IF NOT BIGMAP
-                file.write(bytes([self.w, self.h]))
-                objdata = {}
-                for pos in self.objmap:
-                    if not self.in_bounds(pos):
-                        continue
-                    for obj in self.objmap[pos]:
-                        if obj is not None and str(obj) not in DEPENDENT_OBJS:
-                            s = bytes(obj)
-                            if s not in objdata:
-                                objdata[s] = []
-                            objdata[s].append(obj.pos)
-                for s in objdata:
-                    # We write:
-                    # 1) The object type, followed by newline
-                    # 2) The number of occurences
-                    # 3) The positions
-                    file.write(s)
-                    # IF NOT BIGMAP
-                    file.write(len(objdata[s]).to_bytes(2, byteorder="little"))
-                    pos_list = []
-                    for pos in objdata[s]:
-                        if self.in_bounds(pos):
-                            # IF NOT BIGMAP
-                            pos_list.extend(pos)
-                    file.write(bytes(pos_list))
-                # Signals the end of the Placement Data
-                file.write(bytes([0]))
-                # Write the player's default position
-                file.write(bytes(self.player.pos))
-                # Begin Structural Data
-                for s in self.structures:
-                    file.write(bytes(s))
-        except IOError:
-            print("Failed to write to file")
-            return False
+        self.renumber()
+        self.saver.save(self.snapshot(), filename, callback)
         return True
 
     def load(self, filename=None, start_pos=None, editing=False):
@@ -316,76 +365,63 @@ class GSSokoban(GameState):
         if filename is None:
             return False
         try:
-            with open(filename, "r+b") as file:
-                # IF NOT BIGMAP
-                room_size = file.read(2)
-                self.w = int(room_size[0])
-                self.h = int(room_size[1])
-                self.init_map()
-                # This is what we pass to objects and structures as we make them
-                state_arg = None if editing else self
-                self.player = None
-                self.dynamic = []
-                self.structures = []
-                groups_to_check = set()
-                x, y = 0, 0
-                if not editing:
-                    self.create_wall_border()
-                # First load in the positional data
-                while True:
-                    pieces = file.read(1)[0]
-                    if pieces == 0:
-                        break
-                    sizes = [file.read(1)[0] for _ in range(pieces)]
-                    attrs = [file.read(n) for n in sizes]
-                    obj_type = OBJ_TYPE[attrs[0].decode()]["type"]
-                    args = list(map(unpack_bytes, attrs[1:]))
-                    # IF NOT BIGMAP
-                    n = int.from_bytes(file.read(2), byteorder="little")
-                    pos_str = file.read(2*n)
-                    # IF NOT BIGMAP
-                    for i in range(n):
-                        pos = tuple(map(int, pos_str[2*i : 2*i + 2]))
-                        obj = obj_type(state_arg, pos, *args)
-                        self.objmap[pos][obj.layer] = obj
-                        if obj.dynamic:
-                            self.dynamic.append(obj)
-                        if obj.sticky and not editing:
-                            obj.group.checked = False
-                            groups_to_check.add(obj.group)
-                # Some state behavior is determined by map position
-                if not editing:
-                    for group in groups_to_check:
-                        if not group.checked:
-                            self.merge_groups(group.find_adjacent_groups())
-                # Get the default player position
-                if start_pos is None:
-                    player_pos = tuple(file.read(2))
-                    self.player = Player(self, player_pos)
-                    self.objmap[player_pos][Layer.PLAYER] = self.player
-                    car = self.objmap[self.player.pos][Layer.SOLID]
-                    if car is not None and car.rideable:
-                        self.player.riding = car
-                else:
-                    # Later, we should be able to carry player_pos info from previous room
-                    pass
-                # Load in the structural data of the map
-                while True:
-                    try:
-                        strtype = StrType(file.read(1)[0])
-                    except IndexError:
-                        break
-                    pieces = file.read(1)[0]
-                    sizes = [file.read(1)[0] for _ in range(pieces)]
-                    attrs = [file.read(n) for n in sizes]
-                    self.structures.append(load_str_from_data(self, strtype, attrs))
-            if not editing:
-                for s in self.structures:
-                    s.real_init()
-            self.update_camera()
+            with open(filename, "rb") as file:
+                data = decode_map(file.read())
         except IOError:
             print("Failed to read file")
             return False
+        self.w = data.w
+        self.h = data.h
+        self.init_map()
+        # This is what we pass to objects and structures as we make them
+        state_arg = None if editing else self
+        self.player = None
+        self.dynamic = []
+        self.structures = []
+        # Every saved object, indexed by ID
+        self.objtable = []
+        groups_to_check = set()
+        if not editing:
+            self.create_wall_border()
+        # First place the positional data
+        for name, args, pos in data.objs:
+            obj = OBJ_TYPE[name]["type"](state_arg, pos, *args)
+            self.add_to_table(obj)
+            self.objmap[pos][obj.layer] = obj
+            if obj.dynamic:
+                self.dynamic.append(obj)
+            if obj.sticky and not editing:
+                obj.group.checked = False
+                groups_to_check.add(obj.group)
+        # Some state behavior is determined by map position
+        if not editing:
+            for group in groups_to_check:
+                if not group.checked:
+                    self.merge_groups(group.find_adjacent_groups())
+        # Get the default player position
+        if start_pos is None:
+            player_pos = data.player_pos
+            replaced = self.objmap[player_pos][Layer.PLAYER]
+            self.player = Player(self, player_pos)
+            # The player usually takes the place of a saved Player object
+            if replaced is not None and replaced.id is not None:
+                self.player.id = replaced.id
+                self.objtable[replaced.id] = self.player
+            self.objmap[player_pos][Layer.PLAYER] = self.player
+            car = self.objmap[self.player.pos][Layer.SOLID]
+            if car is not None and car.rideable:
+                self.player.riding = car
+        else:
+            # Later, we should be able to carry player_pos info from previous room
+            pass
+        # Load in the structural data of the map
+        for strtype, attrs in data.structures:
+            self.structures.append(load_str_from_data(self, strtype, attrs, self.objtable))
+        if not editing:
+            for s in self.structures:
+                s.real_init()
+        self.update_camera()
+        self.renderer.invalidate()
         return True
 
     def init_map(self):
@@ -398,20 +434,3 @@ class GSSokoban(GameState):
             for y in range(-1, self.h + 1):
                 if (x,y) not in self.objmap:
                     self.objmap[(x,y)] = [None for _ in range(NUM_LAYERS + 1)]
-
-# Turn a bytestring back into data, according to some simple rules
-# Note we'll never store the integer 0 (need to be clever, use enums, etc)
-def unpack_bytes(s):
-    if s == b"":
-        return False
-    elif s == b"\x00":
-        return True
-    elif len(s) == 3:
-        # This is a color
-        return tuple(s)
-    elif len(s) <= 2:
-        # This is an int, possibly an intenum
-        return int.from_bytes(s, byteorder="little")
-    else:
-        # If it's 4 bytes or longer, we'll assume it's a string
-        return s.decode()
\ No newline at end of file
@@ -3,6 +3,7 @@ from functools import partial
 from tkinter import messagebox
 
 from gs.sokoban import Camera, GSSokoban
+from sokoban_journal import Journal
 from sokoban_obj import *
 from sokoban_str import *
 from font import FONT_MEDIUM, FONT_SMALL
@@ -29,9 +30,14 @@ MAP_JUMP_DISTANCE = 10
 # GUI CONSTANTS
 PADX = 5
 PADY = 5
+# The tk events after which the editor gets redrawn
+EDITOR_TK_EVENTS = ["<ButtonRelease>", "<KeyRelease>"]
 
 VERBOSE = True
 
+# The line of the help text where save results are shown
+SAVE_STATUS_LINE = 5
+
 class GSSokobanEditor(GSSokoban):
     def __init__(self, mgr, parent):
         self.editor = tk.Frame(mgr.root)
@@ -42,6 +48,7 @@ class GSSokobanEditor(GSSokoban):
         self.init_selection()
         self.reinit()
         self.create_text()
+        self.restore_session()
 
     def init_attrs(self):
         """Initialize attributes of the editor"""
@@ -52,6 +59,7 @@ class GSSokobanEditor(GSSokoban):
         self.edit_layer = None
         self.create_args = None
         self.visible = {layer: None for layer in Layer}
+        self.journal = Journal(self)
 
     def init_selection(self):
         self.selectx = 0
@@ -70,7 +78,7 @@ class GSSokobanEditor(GSSokoban):
         # Make sure part of the room is in view; center on player if possible
         if self.player is not None:
             px, py = self.player.pos
-            self.move_camera((px - self.camx - DISPLAY_CX, py - self.camy - DISPLAY_CY))
+            self.move_camera((px - self.camx - (self.view_w - 1)//2, py - self.camy - (self.view_h - 1)//2))
         else:
             self.move_camera((0,0))
 
@@ -78,11 +86,15 @@ class GSSokobanEditor(GSSokoban):
     def init_editor_frame(self):
         # Use this to initialize frame variables
         dummy_frame = tk.Frame()
+        # Anything done with the tk widgets might change what the editor shows
+        # These are bound for the whole application, alongside anyone else's bindings
+        self.tk_bindings = [(sequence, self.editor.bind_all(sequence, self.mark_dirty, add="+"))
+                            for sequence in EDITOR_TK_EVENTS]
         # MAIN MENU BLOCK
         main_menu = tk.Frame(self.editor, padx=PADX, pady=PADY)
         main_menu.pack()
         load_b = tk.Button(main_menu, text="Load", command=self.load_reinit)
-        save_b = tk.Button(main_menu, text="Save", command=self.save)
+        save_b = tk.Button(main_menu, text="Save", command=partial(self.save, callback=self.on_saved))
         clear_b = tk.Button(main_menu, text="Clear", command=self.clear)
         play_b = tk.Button(main_menu, text="Play", command=self.play)
         quit_b = tk.Button(main_menu, text="Quit", command=self.ask_previous_state)
@@ -97,6 +109,8 @@ class GSSokobanEditor(GSSokoban):
                 self.w = min(int(self.room_width_var.get()), 255)
                 self.update_camera()
                 self.expand_map()
+                self.renderer.invalidate()
+                self.journal.record_resize(self.w, self.h)
             except ValueError:
                 pass
 
@@ -105,6 +119,8 @@ class GSSokobanEditor(GSSokoban):
                 self.h = min(int(self.room_height_var.get()), 255)
                 self.update_camera()
                 self.expand_map()
+                self.renderer.invalidate()
+                self.journal.record_resize(self.w, self.h)
             except ValueError:
                 pass
 
@@ -199,6 +215,8 @@ class GSSokobanEditor(GSSokoban):
         # OBJ SELECTION
         def object_property_callback(*args, name=None, var=None):
             setattr(self.cur_object, name, var.get())
+            self.renderer.mark(self.cur_object.pos)
+            self.journal.record_edit(self.cur_object, name)
 
         def build_edit_object_frame():
             self.edit_object_properties.pack_forget()
@@ -292,6 +310,7 @@ class GSSokobanEditor(GSSokoban):
 
     def delete_selected_structure(self):
         if self.cur_structure is not None:
+            self.journal.record_delete_structure(self.structures.index(self.cur_structure))
             self.structures.remove(self.cur_structure)
             self.cur_structure = None
             self.reset_selection()
@@ -315,6 +334,8 @@ class GSSokobanEditor(GSSokoban):
         return var, widget
 
     def draw(self):
+        # The selection and sample change freely, so the editor always redraws everything
+        self.repaint = True
         super().draw()
         self.sample.draw(self.surf, (self.padx, DISPLAY_HEIGHT * MESH + self.pady * 3 // 2))
         self.text.draw(self.surf, (2 * self.padx + MESH, DISPLAY_HEIGHT * MESH + self.pady * 3 // 2))
@@ -331,29 +352,29 @@ class GSSokobanEditor(GSSokoban):
             elif mode == SelectMode.STRUCTURE:
                 selection = self.cur_structure.get_objs()
             color = SELECT_COLOR[mode]
+            mesh = self.mesh
             for obj in selection:
                 x, y = self.real_pos(obj.pos)
                 if obj.layer == Layer.SOLID:
-                    pygame.draw.rect(self.surf, color, Rect(x, y, MESH, MESH), SELECT_THICKNESS)
+                    pygame.draw.rect(self.surf, color, Rect(x, y, mesh, mesh), SELECT_THICKNESS)
                 elif obj.layer == Layer.FLOOR:
-                    pygame.draw.rect(self.surf, color, Rect(x+MESH//6, y+MESH//6, 2*MESH//3 + 1, 2*MESH//3 + 1), SELECT_THICKNESS)
+                    pygame.draw.rect(self.surf, color, Rect(x+mesh//6, y+mesh//6, 2*mesh//3 + 1, 2*mesh//3 + 1), SELECT_THICKNESS)
                 elif obj.layer == Layer.PLAYER:
-                    pygame.draw.circle(self.surf, color, (x+MESH//2, y+MESH//2), MESH//3, SELECT_THICKNESS)
+                    pygame.draw.circle(self.surf, color, (x+mesh//2, y+mesh//2), mesh//3, SELECT_THICKNESS)
 
     def draw_room(self):
-        pygame.draw.rect(self.surf, WHITE, Rect(self.padx, self.pady, MESH * DISPLAY_WIDTH, MESH * DISPLAY_HEIGHT))
-        for layer in Layer:
-            if self.visible[layer].get():
-                self.draw_layer(layer)
-        self.draw_out_of_bounds()
+        self.renderer.layers = [layer for layer in Layer if self.visible[layer].get()]
+        super().draw_room()
 
     def move_camera(self, dir, distance=1):
         dx, dy = dir[0] * distance, dir[1] * distance
-        self.camx = min(max(-DISPLAY_WIDTH+1, self.camx + dx), self.w-1)
-        self.camy = min(max(-DISPLAY_HEIGHT+1, self.camy + dy), self.h-1)
+        self.camx = min(max(-self.view_w+1, self.camx + dx), self.w-1)
+        self.camy = min(max(-self.view_h+1, self.camy + dy), self.h-1)
 
-    def handle_input(self):
-        for event in pygame.event.get(KEYDOWN):
+    def handle_event(self, event):
+        if event.type == KEYDOWN:
+            if self.handle_view_key(event.key):
+                return
             if event.key in DIR.keys():
                 distance = MAP_JUMP_DISTANCE if pygame.key.get_mods() & KMOD_SHIFT else 1
                 self.move_camera(DIR[event.key], distance)
@@ -362,8 +383,8 @@ class GSSokobanEditor(GSSokoban):
             if event.key in OBJ_HOTKEYS:
                 self.create_mode_var.set(OBJ_BY_LAYER[self.edit_layer][OBJ_HOTKEYS[event.key]
                                                                        % len(OBJ_BY_LAYER[self.edit_layer])])
-        for event in pygame.event.get(MOUSEBUTTONDOWN):
-            x, y = pygame.mouse.get_pos()
+        elif event.type == MOUSEBUTTONDOWN:
+            x, y = event.pos
             if self.in_editor(x, y):
                 pos = self.grid_pos(x, y)
                 if self.in_bounds(pos):
@@ -371,14 +392,14 @@ class GSSokobanEditor(GSSokoban):
                         self.handle_right_click(pos)
                     if event.button == MB_LEFT:
                         self.handle_left_click(pos)
-        for event in pygame.event.get(MOUSEMOTION):
-            x, y = pygame.mouse.get_pos()
+        elif event.type == MOUSEMOTION:
+            x, y = event.pos
             if self.in_editor(x, y):
                 pos = self.grid_pos(x, y)
                 if self.in_bounds(pos):
-                    if pygame.mouse.get_pressed()[MB_RIGHT - 1]:
+                    if event.buttons[MB_RIGHT - 1]:
                         self.handle_right_click(pos)
-                    if pygame.mouse.get_pressed()[MB_LEFT-1]:
+                    if event.buttons[MB_LEFT - 1]:
                         self.handle_left_click(pos)
 
     def in_editor(self, x, y):
@@ -444,6 +465,18 @@ class GSSokobanEditor(GSSokoban):
             self.init_selection()
             self.reinit()
             self.reset_selection()
+            self.journal.start()
+
+    def restore_session(self):
+        """Offer to recover the edits of a session that didn't end properly"""
+        if self.journal.exists() and messagebox.askyesno(
+                "Restore", "The editor wasn't closed properly last time.\n"
+                           "Restore the unsaved changes?"):
+            if self.journal.restore():
+                self.init_selection()
+                self.reinit()
+                self.reset_selection()
+        self.journal.start()
 
     def clear(self):
         if messagebox.askokcancel("Clear", "Clear the current map?"):
@@ -455,13 +488,19 @@ class GSSokobanEditor(GSSokoban):
 
     def create(self, pos):
         if self.objmap[pos][self.edit_layer] is None:
-            obj = self.create_mode(None, pos, *(x.get() for x in self.create_args))
-            self.objmap[pos][obj.layer] = obj
-            if obj.is_player:
-                self.player = obj
+            self.place(self.create_mode(None, pos, *(x.get() for x in self.create_args)))
             return True
         return False
 
+    def place(self, obj):
+        """Put a newly created object on the map"""
+        self.add_to_table(obj)
+        self.objmap[obj.pos][obj.layer] = obj
+        self.renderer.mark(obj.pos)
+        if obj.is_player:
+            self.player = obj
+        self.journal.record_create(obj)
+
     def destroy(self, pos, layer):
         obj = self.objmap[pos][layer]
         if obj is not None:
@@ -471,8 +510,13 @@ class GSSokobanEditor(GSSokoban):
                 if obj in s.get_objs():
                     s.remove(self.structures, obj)
             self.objmap[pos][layer] = None
+            self.renderer.mark(pos)
+            # Leave a gap, so no other object's ID changes until the next save
+            if obj.id is not None:
+                self.objtable[obj.id] = None
             if obj.is_player:
                 self.search_for_player()
+            self.journal.record_destroy(pos, layer)
             return True
         return False
 
@@ -489,7 +533,9 @@ class GSSokobanEditor(GSSokoban):
                 gates.append(obj)
             else:
                 return False
-        self.structures.append(SwitchLink(None, switches, gates, self.link_switch_persistent.get()))
+        link = SwitchLink(None, switches, gates, self.link_switch_persistent.get())
+        self.structures.append(link)
+        self.journal.record_link_switch(link)
         self.reset_selection()
         return True
 
@@ -497,7 +543,18 @@ class GSSokobanEditor(GSSokoban):
         pass
 
     def update(self):
-        pass
+        self.saver.check_q()
+
+    def on_saved(self, filename, error):
+        """Called once a background save has finished"""
+        if error is None:
+            self.text.set_line(SAVE_STATUS_LINE, f"Saved {os.path.basename(filename)}")
+            # The map had a player to save, so the journal can catch up
+            self.journal.retry_compact()
+        else:
+            self.text.set_line(SAVE_STATUS_LINE, f"Failed to save {os.path.basename(filename)}")
+            messagebox.showinfo("Error", f"Failed to write to file\n{error}")
+        self.mark_dirty()
 
     def set_sample(self, *args):
         # An "object" at a fake position, not recorded on the grid
@@ -510,11 +567,24 @@ class GSSokobanEditor(GSSokoban):
         self.text.height = 20
         self.text.add_line("Left/Right click to Create/Destroy (only on current layer)")
         self.text.add_line("Hold ctrl while clicking to Select/Deselect")
-        self.text.add_line("Use arrow keys to move; hold shift to move faster")
+        self.text.add_line("Use arrow keys to move; hold shift to move faster; -/= zoom, M for map")
         self.text.add_line("QWE change layers quickly; 1-9 cycle through objects")
         self.text.add_line("In-game Controls: Arrow keys to move, Z to undo")
+        # Reserved for reporting the status of saves
+        self.text.add_line("")
+
+    def unbind_tk_events(self):
+        """Remove the editor's application-wide bindings, leaving any others alone"""
+        # unbind_all() would remove every binding for the sequence
+        for sequence, funcid in self.tk_bindings:
+            script = self.editor.tk.call("bind", "all", sequence)
+            script = "\n".join(line for line in script.split("\n") if funcid not in line)
+            self.editor.tk.call("bind", "all", sequence, script)
+            self.editor.deletecommand(funcid)
+        self.tk_bindings = []
 
     def destroy_editor(self):
+        self.unbind_tk_events()
         widgets = [self.editor]
         for w in widgets:
             widgets.extend(w.winfo_children())
@@ -522,12 +592,17 @@ class GSSokobanEditor(GSSokoban):
             w.destroy()
 
     def play(self):
-        if self.save(TEMP_MAP_FILE):
+        self.save(TEMP_MAP_FILE, callback=self.start_test)
+
+    def start_test(self, filename, error):
+        """Play the map once it's been written to the temp file"""
+        if error is None:
             self.editor.pack_forget()
             GSSokoban(self.mgr, self, testing=True)
 
     def quit(self):
         super().quit()
+        self.journal.close()
         self.destroy_editor()
 
 # Wrappers of tk.Var classes to make things behave conveniently
@@ -2,7 +2,7 @@
 
 import pygame
 
-from background import BGGrid, BGColorChangeGrid, BGCrystal, BGSolid
+from background import BGSolid
 from font import FONT_LARGE
 from game_constants import *
 from game_state import GameState
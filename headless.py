@@ -0,0 +1,138 @@
+"""Run the game with no window, feeding it input from a script
+
+Usage: python headless.py [script] [--map FILE] [--frames N] [--csv]
+
+Nothing is shown and tk is never started, so this works on machines with
+no display.  Frames run one after another as fast as they can, and the
+time spent in each part of a frame is printed at the end.
+
+Each line of a script is one frame's worth of input; blank lines and
+anything after a # are skipped.  The commands are:
+
+    key NAME [COUNT]     press and release a key, on COUNT frames in a row
+    down NAME            press a key
+    up NAME              release a key
+    click X Y [BUTTON]   click the mouse at (X, Y)
+    wait FRAMES          run some frames with no input
+
+Key names are pygame's, like "right", "z" or "escape".  States that open
+tk dialogs (picking a level, or the editor) can't be used headless; use
+--map to play a map instead."""
+
+import argparse
+import os
+import sys
+import time
+
+# There's no window, and no sound
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from game_constants import *
+from gs.sokoban import GSSokoban
+from state_manager import StateManager
+
+
+def key_events(type, name):
+    try:
+        key = pygame.key.key_code(name)
+    except ValueError:
+        raise ValueError(f"Unknown key {name!r}")
+    return [pygame.event.Event(type, key=key, mod=0, scancode=0,
+                               unicode=name if len(name) == 1 else "")]
+
+
+def read_script(file):
+    """Return a list of the events to post on each frame"""
+    frames = []
+    for number, line in enumerate(file, 1):
+        words = line.split("#")[0].split()
+        if not words:
+            continue
+        command, args = words[0], words[1:]
+        try:
+            if command == "key":
+                count = int(args[1]) if len(args) > 1 else 1
+                frames += [key_events(KEYDOWN, args[0]) + key_events(KEYUP, args[0])] * count
+            elif command == "down":
+                frames.append(key_events(KEYDOWN, args[0]))
+            elif command == "up":
+                frames.append(key_events(KEYUP, args[0]))
+            elif command == "click":
+                button = int(args[2]) if len(args) > 2 else MB_LEFT
+                frames.append([pygame.event.Event(MOUSEBUTTONDOWN, pos=(int(args[0]), int(args[1])), button=button)])
+            elif command == "wait":
+                frames += [[]] * int(args[0])
+            else:
+                raise ValueError(f"Unknown command {command!r}")
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"line {number}: {e or 'missing argument'}")
+    return frames
+
+
+def run(manager, frames, extra=0):
+    """Run a frame for each entry of frames, then extra frames with no input
+
+    Stops early if the game quits.  Returns the number of frames run."""
+    count = 0
+    for events in frames + [[]] * extra:
+        if manager.quit:
+            break
+        manager.stats.begin()
+        for event in events:
+            pygame.event.post(event)
+        manager.update()
+        manager.present(manager.draw())
+        manager.stats.end(manager.state)
+        count += 1
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the game with no window, from scripted input")
+    parser.add_argument("script", nargs="?", help="a file of input to play (default: none)")
+    parser.add_argument("--map", help="start by playing this Sokoban map, instead of on the menu")
+    parser.add_argument("--frames", type=int, default=0,
+                        help="how many frames to run after the script ends (default: 0)")
+    parser.add_argument("--csv", action="store_true", help="also write every frame's timings to the stats directory")
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    pygame.event.set_allowed(HANDLED_EVENTS)
+    frames = []
+    if args.script is not None:
+        try:
+            with open(args.script) as file:
+                frames = read_script(file)
+        except (IOError, ValueError) as e:
+            print(f"{args.script}: {e}")
+            return 1
+
+    manager = StateManager(None)
+    if args.map is not None:
+        GSSokoban(manager, manager.state, filename=args.map)
+        if not isinstance(manager.state, GSSokoban):
+            print(f"{args.map}: couldn't load the map")
+            return 1
+
+    start = time.perf_counter()
+    try:
+        count = run(manager, frames, args.frames)
+    except SystemExit:
+        # Something in the game quit the program
+        count = manager.stats.count
+    elapsed = time.perf_counter() - start
+
+    print(f"Ran {count} frames in {elapsed:.3f}s ({count / elapsed if elapsed else 0:.1f} frames/s), "
+          f"ending in {type(manager.state).__name__}")
+    print(manager.stats.report())
+    if args.csv:
+        print(f"Wrote frame timings to {manager.stats.export()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Check a directory of Sokoban maps for problems, without playing them
+
+Usage: python lint_maps.py [directory or files...] [-j JOBS] [--upgrade]
+
+Each map is checked in a separate worker process.  Problems are printed
+one per line, and the exit status is nonzero if any map has problems.
+Maps saved in an older format count as a problem; --upgrade rewrites
+them in the current one."""
+
+import argparse
+import sys
+from functools import partial
+
+from game_constants import MAPS_DIR
+from sokoban_map import MAP_VERSION, decode_map, find_maps, pool_map, upgrade_map, write_atomic
+from sokoban_obj import NUM_LAYERS, OBJ_TYPE
+from sokoban_str import STR_TYPE, StrType, unpack_bytes
+
+# Which object types each structure attribute is allowed to refer to
+REF_TYPES = {StrType.SWITCH_LINK: {"switches": ["Switch"],
+                                   "gates": ["GateBase"]}}
+
+
+def lint_data(data):
+    """Return a list of problems with the bytes of a .map file"""
+    try:
+        room = decode_map(data)
+    except (ValueError, IndexError) as e:
+        return [f"unreadable: {e}"]
+    problems = []
+    if room.version != MAP_VERSION:
+        problems.append(f"saved in format version {room.version}, not {MAP_VERSION} (fix with --upgrade)")
+
+    def in_bounds(pos):
+        return 0 <= pos[0] < room.w and 0 <= pos[1] < room.h
+
+    grid = {(x, y): [None for _ in range(NUM_LAYERS + 1)]
+            for x in range(room.w) for y in range(room.h)}
+    # The same object table the game builds, but holding object names
+    objtable = [name for name, args, pos in room.objs]
+    players = set()
+    for name, args, pos in room.objs:
+        if not in_bounds(pos):
+            problems.append(f"{name} at {pos} is outside the {room.w}x{room.h} room")
+            continue
+        layer = OBJ_TYPE[name]["layer"]
+        if grid[pos][layer] is not None:
+            problems.append(f"{name} at {pos} shares the {layer.name} layer with {grid[pos][layer]}")
+            continue
+        grid[pos][layer] = name
+        if name == "Player":
+            players.add(pos)
+
+    if not in_bounds(room.player_pos):
+        problems.append(f"Player start {room.player_pos} is outside the {room.w}x{room.h} room")
+    players.add(room.player_pos)
+    if len(players) != 1:
+        problems.append(f"{len(players)} player starts: {sorted(players)}")
+
+    for i, (strtype, attrs) in enumerate(room.structures):
+        label = f"{STR_TYPE[strtype]['type'].__name__} #{i}"
+        arg_types = STR_TYPE[strtype]["args"]
+        if len(attrs) != len(arg_types):
+            problems.append(f"{label} has {len(attrs)} attributes, expected {len(arg_types)}")
+            continue
+        for (attr, typename), data in zip(arg_types, attrs):
+            if typename not in ["obj", "obj[]"]:
+                continue
+            try:
+                refs = unpack_bytes(data, objtable, typename)
+            except IndexError:
+                problems.append(f"{label} {attr} refers to an object that doesn't exist")
+                continue
+            if typename == "obj":
+                refs = [refs]
+            allowed = REF_TYPES.get(strtype, {}).get(attr)
+            for ref in refs:
+                if allowed is not None and ref not in allowed:
+                    problems.append(f"{label} {attr} refers to a {ref}, expected {' or '.join(allowed)}")
+    return problems
+
+
+def lint_file(filename, upgrade=False):
+    try:
+        with open(filename, "rb") as file:
+            data = file.read()
+        problems = lint_data(data)
+        # The version is the first thing checked, so it's the first problem
+        if upgrade and problems and problems[0].startswith("saved in format version"):
+            write_atomic(filename, upgrade_map(decode_map(data)))
+            return filename, problems[1:], True
+        return filename, problems, False
+    except IOError as e:
+        return filename, [f"unreadable: {e}"], False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check Sokoban maps for problems")
+    parser.add_argument("paths", nargs="*", default=[MAPS_DIR],
+                        help="map files or directories of maps (default: the maps directory)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--upgrade", action="store_true",
+                        help="rewrite maps saved in an older format in the current one")
+    args = parser.parse_args(argv)
+
+    files = find_maps(args.paths)
+    bad = 0
+    upgraded = 0
+    lint = partial(lint_file, upgrade=args.upgrade)
+    for filename, problems, was_upgraded in pool_map(lint, files, args.jobs):
+        if was_upgraded:
+            upgraded += 1
+            print(f"{filename}: upgraded to format version {MAP_VERSION}")
+        if problems:
+            bad += 1
+            for problem in problems:
+                print(f"{filename}: {problem}")
+    print(f"Checked {len(files)} maps, {bad} with problems" + (f", {upgraded} upgraded" if upgraded else ""))
+    return 1 if bad else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
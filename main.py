@@ -1,7 +1,7 @@
-import time
 import tkinter as tk
 import pygame
 
+from frame_clock import FrameClock
 from game_constants import *
 from state_manager import StateManager
 
@@ -16,8 +16,7 @@ def main():
     root.update()
     # initialize pygame
     pygame.init()
-    # These are the only events we care about handling
-    pygame.event.set_allowed([KEYUP, KEYDOWN, MOUSEBUTTONDOWN, ACTIVEEVENT])
+    pygame.event.set_allowed(HANDLED_EVENTS)
     pygame.mouse.set_visible(True)
     manager = StateManager(root)
 
@@ -26,17 +25,23 @@ def main():
     # Main game loop
     # We put root.update() in here so that pygame.display.update()
     # doesn't interrupt tkinter's event handling
+    clock = FrameClock()
+    frames = 0
     while not manager.quit:
-        t = time.clock()
-        manager.update()
-        manager.draw()
-        pygame.display.update()
+        clock.wait()
+        manager.stats.begin()
+        for _ in range(clock.ticks()):
+            manager.update()
+            if manager.quit:
+                break
+        manager.present(manager.draw())
         root.update()
-        dt = 1000*(time.clock() - t)
-        REAL_FPS = round(1000.0 / dt)
-        root.title(f"FPS: {min(REAL_FPS, FPS)}/{FPS}")
-        # The FPS is actually slightly more.  This shouldn't matter.
-        root.after(max(1, round(FRAME_TIME - dt)-1))
+        manager.stats.lap("tk")
+        manager.stats.end(manager.state)
+        # Setting the title isn't free, so only do it about once a second
+        frames += 1
+        if frames % FPS == 0:
+            root.title(f"FPS: {clock.real_fps():.1f}/{FPS}  jitter: {clock.jitter():.1f}ms")
 
     manager.terminate()
 
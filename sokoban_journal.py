@@ -0,0 +1,255 @@
+"""An append-only record of the edits made in the Sokoban editor
+
+If the editor crashes, the last session can be rebuilt by loading the
+most recent compacted map and replaying the journal on top of it."""
+
+import os
+from enum import IntEnum, auto
+from functools import partial
+
+from game_constants import *
+from sokoban_map import unpack_attr, unpack_obj, write_atomic
+from sokoban_obj import OBJ_TYPE, Layer, pack_obj
+from sokoban_str import SwitchLink
+
+JOURNAL_MAGIC = b"SKJ1"
+HEADER_SIZE = len(JOURNAL_MAGIC) + 4
+
+
+class Op(IntEnum):
+    """The kinds of records in the journal.  Don't reorder these!"""
+    CREATE = auto()
+    DESTROY = auto()
+    EDIT = auto()
+    LINK_SWITCH = auto()
+    DELETE_STRUCTURE = auto()
+    RESIZE = auto()
+
+
+def base_file(generation):
+    return os.path.join(AUTOSAVE_DIR, f"{AUTOSAVE_MAP_PREFIX}{generation}.mapx")
+
+
+# Structures are journaled with positions rather than their map encoding,
+# so that records stay valid no matter how the objects get numbered on save
+# IF NOT BIGMAP
+def pack_refs(objs):
+    return bytes([len(objs)]) + b"".join(bytes([*obj.pos, obj.layer]) for obj in objs)
+
+
+def unpack_refs(data, i, objmap):
+    n = data[i]
+    objs = [objmap[(data[j], data[j + 1])][data[j + 2]] for j in range(i + 1, i + 1 + 3*n, 3)]
+    if None in objs:
+        raise ValueError("Structure refers to an empty position")
+    return objs, i + 1 + 3*n
+
+
+class Journal:
+    """Records editor operations; old records get folded into a full map every so often
+
+    On disk there's the journal itself, whose header names a "generation",
+    and the map __autosave_<generation>.mapx that the records apply to.
+    A new generation's map is always completely written before the journal
+    switches over to it, so a crash at any point leaves a consistent pair."""
+    def __init__(self, editor):
+        self.editor = editor
+        self.file = None
+        self.generation = 0
+        self.records = 0
+        # Off while replaying, so the replayed edits aren't journaled again
+        self.recording = True
+        # The generation being compacted into, if any
+        self.target = None
+        # Records made since the target's snapshot was taken
+        self.buffer = []
+        # Set when the map had no player to save, so compacting waits for one
+        self.waiting = False
+
+    @staticmethod
+    def exists():
+        return os.path.exists(AUTOSAVE_JOURNAL_FILE)
+
+    def start(self):
+        """Begin a fresh journal based on the editor's current map"""
+        self.close_file()
+        if not self.compact(reset=True):
+            # The old journal describes some other map; after a crash,
+            # replaying it would bring back the wrong edits
+            self.discard()
+
+    def append(self, op, payload):
+        if not self.recording:
+            return
+        record = bytes([op]) + payload
+        record = len(record).to_bytes(2, byteorder="little") + record
+        if self.file is not None:
+            self.file.write(record)
+            # Flushing is enough to survive the game crashing;
+            # compaction is what gets fsynced
+            self.file.flush()
+            self.records += 1
+        if self.target is not None:
+            self.buffer.append(record)
+        elif self.waiting:
+            return
+        elif self.file is None or self.records >= AUTOSAVE_COMPACT_RECORDS:
+            # If there's no journal yet, this is our chance to start one
+            self.compact()
+
+    def compact(self, reset=False):
+        """Write the editor's map out as a new generation, in the background
+
+        If reset, the current journal stops being written to immediately;
+        it won't describe the editor's map anymore."""
+        editor = self.editor
+        if editor.player is None and not editor.search_for_player():
+            # A map without a player can't be saved; keep using the old journal,
+            # and don't look for a player on every edit until one is placed
+            self.waiting = True
+            return False
+        self.waiting = False
+        if reset:
+            self.close_file()
+        self.target = max(self.generation, self.target or 0) + 1
+        self.buffer = []
+        os.makedirs(AUTOSAVE_DIR, exist_ok=True)
+        editor.renumber()
+        editor.saver.save(editor.snapshot(), base_file(self.target),
+                          partial(self.finish_compact, self.target))
+        return True
+
+    def retry_compact(self):
+        """Compact now if an earlier compaction had to wait for the map to get a player"""
+        if self.waiting and self.recording:
+            self.compact()
+
+    def finish_compact(self, generation, filename, error):
+        if generation != self.target:
+            # A later compaction has replaced this one
+            return
+        self.target = None
+        if error is not None:
+            return
+        self.close_file()
+        write_atomic(AUTOSAVE_JOURNAL_FILE, JOURNAL_MAGIC
+                     + generation.to_bytes(4, byteorder="little")
+                     + b"".join(self.buffer))
+        self.generation = generation
+        self.records = len(self.buffer)
+        self.buffer = []
+        self.file = open(AUTOSAVE_JOURNAL_FILE, "ab")
+        self.remove_bases(keep=generation)
+
+    def close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        """Stop journaling and throw the journal away; the session ended normally"""
+        self.discard()
+
+    def discard(self):
+        """Throw away the journal and the maps it applies to"""
+        self.close_file()
+        self.target = None
+        self.buffer = []
+        # A compaction that's still being written would leave its map behind
+        self.editor.saver.wait()
+        if self.exists():
+            os.remove(AUTOSAVE_JOURNAL_FILE)
+        self.remove_bases()
+
+    def remove_bases(self, keep=None):
+        keep = None if keep is None else os.path.basename(base_file(keep))
+        try:
+            names = os.listdir(AUTOSAVE_DIR)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(AUTOSAVE_MAP_PREFIX) and name != keep:
+                try:
+                    os.remove(os.path.join(AUTOSAVE_DIR, name))
+                except OSError:
+                    pass
+
+    # Recording
+    def record_create(self, obj):
+        self.append(Op.CREATE, pack_obj(obj.name(), obj.args()) + bytes(obj.pos))
+        if obj.is_player:
+            self.retry_compact()
+
+    def record_destroy(self, pos, layer):
+        self.append(Op.DESTROY, bytes([*pos, layer]))
+
+    def record_edit(self, obj, attr):
+        names = [x[0] for x in OBJ_TYPE[obj.name()]["args"]]
+        self.append(Op.EDIT, bytes([*obj.pos, obj.layer, names.index(attr)])
+                    + bytes(getattr(obj, attr)))
+
+    def record_link_switch(self, link):
+        self.append(Op.LINK_SWITCH, bytes([link.persistent])
+                    + pack_refs(link.switches) + pack_refs(link.gates))
+
+    def record_delete_structure(self, index):
+        self.append(Op.DELETE_STRUCTURE, index.to_bytes(2, byteorder="little"))
+
+    def record_resize(self, w, h):
+        # IF NOT BIGMAP
+        self.append(Op.RESIZE, bytes([w, h]))
+
+    # Recovery
+    def restore(self):
+        """Load the last session's map into the editor and replay its edits
+
+        Returns True if the editor's map was replaced"""
+        try:
+            with open(AUTOSAVE_JOURNAL_FILE, "rb") as file:
+                data = file.read()
+        except IOError:
+            return False
+        if data[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+            return False
+        generation = int.from_bytes(data[len(JOURNAL_MAGIC):HEADER_SIZE], byteorder="little")
+        if not self.editor.load(filename=base_file(generation), editing=True):
+            return False
+        i = HEADER_SIZE
+        self.recording = False
+        while i + 2 <= len(data):
+            size = int.from_bytes(data[i:i + 2], byteorder="little")
+            record = data[i + 2:i + 2 + size]
+            # A record cut short by a crash is the end of the journal
+            if size == 0 or len(record) < size:
+                break
+            try:
+                self.replay(Op(record[0]), record[1:])
+            except (ValueError, IndexError, KeyError, AttributeError):
+                print("Skipping a journal record that couldn't be replayed")
+            i += 2 + size
+        self.recording = True
+        return True
+
+    def replay(self, op, data):
+        editor = self.editor
+        if op == Op.CREATE:
+            name, args, i = unpack_obj(data)
+            obj = OBJ_TYPE[name]["type"](None, tuple(data[i:i + 2]), *args)
+            editor.place(obj)
+        elif op == Op.DESTROY:
+            editor.destroy((data[0], data[1]), Layer(data[2]))
+        elif op == Op.EDIT:
+            obj = editor.objmap[(data[0], data[1])][data[2]]
+            attr = OBJ_TYPE[obj.name()]["args"][data[3]][0]
+            setattr(obj, attr, unpack_attr(data[4:]))
+            editor.renderer.mark(obj.pos)
+        elif op == Op.LINK_SWITCH:
+            switches, i = unpack_refs(data, 1, editor.objmap)
+            gates, i = unpack_refs(data, i, editor.objmap)
+            editor.structures.append(SwitchLink(None, switches, gates, bool(data[0])))
+        elif op == Op.DELETE_STRUCTURE:
+            del editor.structures[int.from_bytes(data, byteorder="little")]
+        elif op == Op.RESIZE:
+            editor.w, editor.h = data[0], data[1]
+            editor.expand_map()
+            editor.renderer.invalidate()
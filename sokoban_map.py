@@ -0,0 +1,334 @@
+"""Encoding rooms into the .map format, and writing them out safely"""
+
+import os
+import tempfile
+import threading
+from multiprocessing import Pool
+from queue import Queue, Empty
+
+from sokoban_obj import OBJ_TYPE, pack_obj
+from sokoban_str import DATA_SIZE, STR_TYPE, StrType
+
+
+MAP_EXTENSIONS = (".map", ".mapx")
+
+# A file starts with a 0 byte and then its format version.  Files from before
+# there was a version start with the room's width instead, which is never 0.
+MAP_VERSION = 2
+# In version 1, structures referred to objects by (x, y, layer), not by ID
+LEGACY_VERSION = 1
+
+# New files get the usual permissions; the umask can't be read without changing it
+NEW_FILE_MODE = 0o644
+
+
+def find_maps(paths):
+    """Expand a list of map files and directories into a list of map files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.endswith(MAP_EXTENSIONS)))
+        else:
+            files.append(path)
+    return files
+
+
+def pool_map(func, items, jobs=None, chunksize=None, ordered=True):
+    """Run func on each of items in a pool of jobs worker processes (default:
+    one per CPU), yielding the results in order, or as they finish if not ordered
+
+    The map tools all use this.  Without a chunksize, items must be a list,
+    and each worker gets several chunks of it."""
+    # The workers import pygame too; one greeting is plenty
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    if chunksize is None:
+        chunksize = max(1, len(items) // (8 * (jobs or os.cpu_count() or 1)))
+    with Pool(jobs) as pool:
+        results = pool.imap if ordered else pool.imap_unordered
+        yield from results(func, items, chunksize)
+
+
+class MapSnapshot:
+    """Everything needed to write a room to disk, copied out of the live map
+
+    Taking one is cheap enough to do on the main thread; all of the
+    actual encoding happens later, in encode_map()"""
+    def __init__(self, w, h, objs, player_pos, structures):
+        self.w = w
+        self.h = h
+        # A list of (name, args, pos) for every object that gets saved
+        self.objs = objs
+        self.player_pos = player_pos
+        # Structures are tiny, so they're stored already encoded
+        self.structures = structures
+
+
+class MapData:
+    """The contents of a .map file, decoded but not built into a room"""
+    def __init__(self, w, h, objs, player_pos, structures, version=MAP_VERSION):
+        self.w = w
+        self.h = h
+        # A list of (name, args, pos), in the order they appear in the file
+        self.objs = objs
+        self.player_pos = player_pos
+        # A list of (strtype, attrs), where attrs are still raw bytes
+        # Object references are always IDs, whatever version the file was
+        self.structures = structures
+        # The format the file was written in
+        self.version = version
+
+
+def group_objs(objs, key):
+    """Reorder objs so that the ones with the same key are next to each other
+
+    Identical objects share a header in the file, so this keeps it small.
+    Otherwise objects keep their relative order."""
+    groups = {}
+    for obj in objs:
+        groups.setdefault(key(obj), []).append(obj)
+    return [obj for group in groups.values() for obj in group]
+
+
+def encode_map(snapshot):
+    """Turn a MapSnapshot into the bytes of a .map file
+
+    Objects are written in the order they're given, since an object's ID is
+    its place in the file; use group_objs() first to keep the file small"""
+    # IF NOT BIGMAP
+    data = [bytes([0, MAP_VERSION, snapshot.w, snapshot.h])]
+    # A list of (header, positions), one for each run of identical objects
+    objdata = []
+    for name, args, pos in snapshot.objs:
+        s = pack_obj(name, args)
+        if not objdata or objdata[-1][0] != s:
+            objdata.append((s, []))
+        # IF NOT BIGMAP
+        objdata[-1][1].extend(pos)
+    for s, pos_list in objdata:
+        # We write:
+        # 1) The object type
+        # 2) The number of occurences
+        # 3) The positions
+        data.append(s)
+        # IF NOT BIGMAP
+        data.append((len(pos_list) // 2).to_bytes(2, byteorder="little"))
+        data.append(bytes(pos_list))
+    # Signals the end of the Placement Data
+    data.append(bytes([0]))
+    # Write the player's default position
+    data.append(bytes(snapshot.player_pos))
+    # Begin Structural Data
+    data.extend(snapshot.structures)
+    return b"".join(data)
+
+
+# Turn a bytestring back into data, according to some simple rules
+# Note we'll never store the integer 0 (need to be clever, use enums, etc)
+def unpack_attr(s):
+    if s == b"":
+        return False
+    elif s == b"\x00":
+        return True
+    elif len(s) == 3:
+        # This is a color
+        return tuple(s)
+    elif len(s) <= 2:
+        # This is an int, possibly an intenum
+        return int.from_bytes(s, byteorder="little")
+    else:
+        # If it's 4 bytes or longer, we'll assume it's a string
+        return s.decode()
+
+
+def unpack_obj(data, i=0):
+    """Read an object header written by pack_obj, starting at data[i]
+
+    Returns the object's name, its args, and the index just past the header"""
+    pieces = data[i]
+    sizes = data[i + 1 : i + 1 + pieces]
+    i += 1 + pieces
+    attrs = []
+    for n in sizes:
+        attrs.append(data[i : i + n])
+        i += n
+    name = attrs[0].decode()
+    if name not in OBJ_TYPE:
+        raise ValueError(f"Unknown object type {name!r}")
+    return name, [unpack_attr(x) for x in attrs[1:]], i
+
+
+def decode_map(data):
+    """Split the bytes of a .map file into a MapData
+
+    Files in the legacy format are read too, and their structures' object
+    references turned into IDs.  Raises ValueError (or IndexError, if the
+    file is cut short) on bad data"""
+    if data[0] == 0:
+        version = data[1]
+        if not LEGACY_VERSION < version <= MAP_VERSION:
+            raise ValueError(f"Unknown map format version {version}")
+        i = 2
+    else:
+        version = LEGACY_VERSION
+        i = 0
+    # IF NOT BIGMAP
+    w, h = data[i], data[i + 1]
+    i += 2
+    objs = []
+    # First the positional data, which ends with a 0
+    while data[i] != 0:
+        name, args, i = unpack_obj(data, i)
+        # IF NOT BIGMAP
+        n = int.from_bytes(data[i:i + 2], byteorder="little")
+        i += 2
+        if i + 2*n > len(data):
+            raise IndexError("Positional data is cut short")
+        for j in range(i, i + 2*n, 2):
+            objs.append((name, args, (data[j], data[j + 1])))
+        i += 2*n
+    # The default player position
+    player_pos = (data[i + 1], data[i + 2])
+    i += 3
+    # Then the structural data, until the end of the file
+    structures = []
+    while i < len(data):
+        strtype = StrType(data[i])
+        pieces = data[i + 1]
+        sizes = data[i + 2 : i + 2 + pieces]
+        i += 2 + pieces
+        attrs = []
+        for n in sizes:
+            attrs.append(data[i : i + n])
+            i += n
+        if i > len(data):
+            raise IndexError("Structural data is cut short")
+        structures.append((strtype, attrs))
+    if version == LEGACY_VERSION:
+        structures = upgrade_refs(objs, structures)
+    return MapData(w, h, objs, player_pos, structures, version)
+
+
+def map_refs(strtype, attrs, convert):
+    """Return a structure's attrs, with each object reference passed through convert()"""
+    size = DATA_SIZE["obj"]
+    new = []
+    for (attrname, typename), attr in zip(STR_TYPE[strtype]["args"], attrs):
+        if typename == "obj":
+            attr = convert(attr)
+        elif typename == "obj[]":
+            attr = attr[:1] + b"".join(convert(attr[1 + size*j : 1 + size*(j+1)]) for j in range(attr[0]))
+        new.append(attr)
+    return new + attrs[len(new):]
+
+
+def upgrade_refs(objs, structures):
+    """Turn legacy (x, y, layer) object references into IDs"""
+    ids = {(pos, OBJ_TYPE[name]["layer"]): i for i, (name, args, pos) in enumerate(objs)}
+
+    def convert(ref):
+        key = ((ref[0], ref[1]), ref[2])
+        if key not in ids:
+            raise ValueError(f"A structure refers to an empty spot {tuple(ref)}")
+        return ids[key].to_bytes(DATA_SIZE["obj"], byteorder="little")
+
+    return [(strtype, map_refs(strtype, attrs, convert)) for strtype, attrs in structures]
+
+
+def encode_structure(strtype, attrs):
+    return bytes([strtype, len(attrs)] + [len(x) for x in attrs]) + b"".join(attrs)
+
+
+def upgrade_map(data):
+    """Return a MapData's bytes in the current format"""
+    # Rewriting groups identical objects together, which can renumber them
+    order = group_objs(range(len(data.objs)), key=lambda i: pack_obj(*data.objs[i][:2]))
+    new_id = {old: new for new, old in enumerate(order)}
+
+    def convert(ref):
+        old = int.from_bytes(ref, byteorder="little")
+        if old not in new_id:
+            raise ValueError(f"A structure refers to object {old}, which doesn't exist")
+        return new_id[old].to_bytes(DATA_SIZE["obj"], byteorder="little")
+
+    structures = [encode_structure(strtype, map_refs(strtype, attrs, convert))
+                  for strtype, attrs in data.structures]
+    return encode_map(MapSnapshot(data.w, data.h, [data.objs[i] for i in order],
+                                  data.player_pos, structures))
+
+
+def write_atomic(filename, data):
+    """Replace filename with data, so that a crash leaves either the old file or the new one"""
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, temp = tempfile.mkstemp(prefix=".", suffix=".tmp", dir=dirname)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        # mkstemp() makes the file private; keep the old file's permissions instead
+        try:
+            mode = os.stat(filename).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = NEW_FILE_MODE
+        os.chmod(temp, mode)
+        os.replace(temp, filename)
+    except BaseException:
+        os.remove(temp)
+        raise
+    # The rename itself isn't durable until the directory is synced
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def save_thread(snapshot, filename, job, result_q, previous):
+    # Saves finish in the order they were requested
+    if previous is not None:
+        previous.join()
+    try:
+        write_atomic(filename, encode_map(snapshot))
+        result_q.put((job, filename, None))
+    # Anything going wrong has to be reported, or the callback never runs
+    except Exception as e:
+        result_q.put((job, filename, e))
+
+
+class MapSaver:
+    """Writes MapSnapshots on worker threads, and reports back through check_q()"""
+    def __init__(self):
+        self.result_q = Queue()
+        self.callbacks = {}
+        self.jobs = 0
+        self.last_thread = None
+
+    def save(self, snapshot, filename, callback=None):
+        """Start saving in the background.  callback(filename, error) is called
+        from check_q() once the file is on disk (error is None on success)"""
+        self.jobs += 1
+        self.callbacks[self.jobs] = callback
+        self.last_thread = threading.Thread(target=save_thread,
+                                            args=(snapshot, filename, self.jobs,
+                                                  self.result_q, self.last_thread))
+        self.last_thread.start()
+
+    def wait(self):
+        """Block until every save that's been started is on disk"""
+        if self.last_thread is not None:
+            self.last_thread.join()
+
+    def check_q(self):
+        """Run the callbacks of any saves which have finished"""
+        while True:
+            try:
+                job, filename, error = self.result_q.get(block=False)
+            except Empty:
+                break
+            callback = self.callbacks.pop(job)
+            if error is not None:
+                print(f"Failed to write to file: {error}")
+            if callback is not None:
+                callback(filename, error)
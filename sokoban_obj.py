@@ -27,8 +27,6 @@ class Layer(IntEnum):
 NUM_LAYERS = 3
 
 class GameObj:
-    ID_COUNT = 0
-
     def __init__(self, state, pos, color=None, layer=None,
                  rideable=False, pushable=False, sticky=False,
                  is_player=False, is_switch=False, is_switchable=False,
@@ -58,11 +56,13 @@ class GameObj:
         # Dynamic objects are alerted when anything moves
         self.dynamic = dynamic
 
-        # Real objects get groups and IDs
+        # Saved objects are numbered by the room they're in;
+        # see GSSokoban.add_to_table()
+        self.id = None
+
+        # Real objects get groups
         if not self.virtual:
             self.group = Group(state, {self})
-            self.id = GameObj.ID_COUNT
-            GameObj.ID_COUNT += 1
             self.real_init()
 
     def real_init(self):
@@ -84,6 +84,10 @@ class GameObj:
                                MESH // 4 + RIDE_CIRCLE_THICKNESS//2,
                                RIDE_CIRCLE_THICKNESS)
 
+    def sprite_key(self):
+        """Everything that affects how draw() looks; see sokoban_render.Atlas"""
+        return (self.name(), self.color, self.pushable and not self.sticky, self.rideable)
+
     def push_delta(self, delta):
         self.state.delta.add_dynamic(self, delta)
 
@@ -99,12 +103,12 @@ class GameObj:
     def name(self):
         return self.__class__.__name__
 
+    def args(self):
+        """The values of the attributes which get saved to the .map"""
+        return tuple(getattr(self, x[0]) for x in OBJ_TYPE[self.name()]["args"])
+
     def __bytes__(self):
-        name = self.name()
-        attrs = [name.encode(encoding="utf-8")]
-        attrs += [bytes(getattr(self, x[0])) for x in OBJ_TYPE[name]["args"]]
-        sizes = bytes([len(attrs)] + [len(x) for x in attrs])
-        return sizes + b"".join(attrs)
+        return pack_obj(self.name(), self.args())
 
 
 # This is basically a structure, but we don't treat it that way
@@ -162,6 +166,9 @@ class Player(GameObj):
         center = (pos[0] + MESH // 2, pos[1] + MESH // 2)
         pygame.draw.circle(surf, self.color, center, MESH // 4, 0)
 
+    def sprite_key(self):
+        return (self.name(), self.color)
+
 
 class GateBase(GameObj):
     def __init__(self, state, pos, color, wall_color, default):
@@ -233,6 +240,9 @@ class GateBase(GameObj):
         else:
             pygame.draw.rect(surf, self.color, Rect(x, y, MESH, MESH))
 
+    def sprite_key(self):
+        return (self.name(), self.wall_color if self.virtual and self.default else self.color)
+
 
 class GateWall(GameObj):
     def __init__(self, state, pos, color):
@@ -314,6 +324,9 @@ class Switch(GameObj):
         pygame.draw.line(surf, BLACK, (x+MESH//2-1, y+MESH//4), (x+MESH//2-1, y+3*MESH//4), 2)
         pygame.draw.line(surf, BLACK, (x+MESH//4, y+MESH//2-1), (x+3*MESH//4, y+MESH//2-1), 2)
 
+    def sprite_key(self):
+        return (self.name(), self.color, self.active, self.semi and not self.active)
+
 STANDARD_COLORS = ["Red", "Blue", "Green", "Purple", "Gold"]
 SWITCH_COLORS = ["SwRed", "SwBlue", "SwGreen", "SwPurple"]
 GATE_COLORS = ["LightGrey", "NavyBlue"]
@@ -321,9 +334,11 @@ GATE_COLORS = ["LightGrey", "NavyBlue"]
 # keys must exactly match the corresponding class name
 # args is a list of (attr, type)s
 # attr should exactly match the actual attribute of the class
+# static objects never move or change appearance during play
 OBJ_TYPE = {"Wall":
                 {"type": Wall,
                  "layer": Layer.SOLID,
+                 "static": True,
                  "args": [("color", "color")],
                  "color": ["Black"]},
             "Box":
@@ -359,6 +374,15 @@ for x in OBJ_TYPE:
 for x in DEPENDENT_OBJS:
     OBJ_TYPE[x]["save"] = False
 
+
+def pack_obj(name, args):
+    """Encode an object type and its attribute values the way they appear in a .map"""
+    attrs = [name.encode(encoding="utf-8")]
+    attrs += [bytes(x) for x in args]
+    sizes = bytes([len(attrs)] + [len(x) for x in attrs])
+    return sizes + b"".join(attrs)
+
+
 # Produce a list of key strings for each layer
 OBJ_BY_LAYER = {}
 
@@ -0,0 +1,384 @@
+"""Drawing the board of a Sokoban room, redrawing as little as possible"""
+
+from itertools import product
+
+import numpy as np
+import pygame
+from pygame.rect import Rect
+
+from game_constants import *
+from sokoban_obj import Layer, NUM_LAYERS, OBJ_TYPE
+
+# What the occupancy index holds for each cell of each layer
+EMPTY = 0
+OBJECT = 1
+STATIC = 2
+
+
+def is_static(obj):
+    """Static objects never move or change, so they can be drawn once and cached"""
+    return OBJ_TYPE[obj.name()].get("static", False)
+
+
+def sample_objs():
+    """Virtual objects in every color and state the editor can make"""
+    for name, info in OBJ_TYPE.items():
+        choices = [[ColorEnum[color].value for color in info["color"]] if typename == "color"
+                   else [False, True]
+                   for attr, typename in info["args"]]
+        for args in product(*choices):
+            obj = info["type"](None, None, *args)
+            if obj.is_switch:
+                for obj.semi, obj.active in [(False, False), (True, False), (False, True)]:
+                    yield obj
+            else:
+                yield obj
+
+
+class Atlas:
+    """Pre-rendered images of objects, so drawing one is a single blit
+
+    Sprites are keyed by GameObj.sprite_key(), and are drawn by the objects'
+    own draw() methods.  Anything not made up front is added when first seen."""
+    def __init__(self, mesh=MESH):
+        self.mesh = mesh
+        self.sprites = {}
+        for obj in sample_objs():
+            self.add(obj)
+
+    def add(self, obj):
+        surf = pygame.Surface((MESH, MESH), SRCALPHA)
+        obj.draw(surf, (0, 0))
+        if self.mesh != MESH:
+            surf = pygame.transform.smoothscale(surf, (self.mesh, self.mesh))
+        # Match the display's pixel format, if there is one, so blits are fast
+        if pygame.display.get_surface() is not None:
+            if pygame.mask.from_surface(surf).count() == self.mesh * self.mesh:
+                surf = surf.convert()
+            else:
+                surf = surf.convert_alpha()
+        self.sprites[obj.sprite_key()] = surf
+        return surf
+
+    def sprite(self, obj):
+        try:
+            return self.sprites[obj.sprite_key()]
+        except KeyError:
+            return self.add(obj)
+
+
+# One Atlas per tile size
+ATLASES = {}
+
+
+def get_atlas(mesh=MESH):
+    if mesh not in ATLASES:
+        ATLASES[mesh] = Atlas(mesh)
+    return ATLASES[mesh]
+
+
+class BoardRenderer:
+    """Keeps an up to date image of the visible part of a room
+
+    There are two cached images of the board: one with just the background
+    and static objects, and one with everything.  When the camera moves they
+    are scrolled, and only the strips coming into view are drawn; otherwise
+    only the tiles that were marked as changed get redrawn, and only they
+    need to be pushed to the display."""
+    def __init__(self, state):
+        self.state = state
+        self.size = (DISPLAY_WIDTH * MESH, DISPLAY_HEIGHT * MESH)
+        self.static = pygame.Surface(self.size)
+        self.board = pygame.Surface(self.size)
+        self.mesh = state.mesh
+        self.atlas = get_atlas(self.mesh)
+        self.minimap = Minimap(self)
+        # Which layers get drawn (the editor can hide some)
+        self.layers = list(Layer)
+        # What the caches currently show; None means they're out of date
+        self.view = None
+        self.dirty = set()
+        # index[layer, x, y] says whether there's an object there, and whether it's static
+        self.index = None
+
+    def invalidate(self):
+        """Throw away the caches, e.g. because a new map was loaded"""
+        self.view = None
+        self.index = None
+
+    def set_mesh(self, mesh):
+        """Draw spots at a new size (the board itself stays the same size)"""
+        self.mesh = mesh
+        self.atlas = get_atlas(mesh)
+        self.view = None
+
+    def build_index(self):
+        w, h = self.state.w, self.state.h
+        self.index = np.zeros((NUM_LAYERS + 1, w, h), dtype=np.uint8)
+        self.minimap.resize(w, h)
+        for x in range(w):
+            for y in range(h):
+                self.index_tile((x, y))
+
+    def index_tile(self, pos):
+        x, y = pos
+        if not (0 <= x < self.index.shape[1] and 0 <= y < self.index.shape[2]):
+            return
+        for layer in Layer:
+            obj = self.state.objmap[pos][layer]
+            if obj is None:
+                self.index[layer, x, y] = EMPTY
+            else:
+                self.index[layer, x, y] = STATIC if is_static(obj) else OBJECT
+            self.minimap.set_tile(layer, x, y, obj)
+
+    def mark(self, pos):
+        """The tile at pos has to be redrawn"""
+        self.dirty.add(pos)
+
+    def mark_delta(self, delta):
+        """Mark every tile that a Delta touched"""
+        for (dx, dy), moves in delta.moves.items():
+            for (x, y), layer in moves:
+                self.mark((x, y))
+                self.mark((x + dx, y + dy))
+        for obj, _ in delta.dynamic:
+            self.mark(obj.pos)
+
+    def local_pos(self, pos):
+        return (pos[0] - self.state.camx) * self.mesh, (pos[1] - self.state.camy) * self.mesh
+
+    def window(self):
+        """The part of the grid in view"""
+        return Rect(self.state.camx, self.state.camy, self.state.view_w, self.state.view_h)
+
+    def in_room(self, area):
+        """The part of a rect of the grid that's inside the room"""
+        return area.clip(Rect(0, 0, self.state.w, self.state.h))
+
+    def margins(self, area):
+        """The parts of a rect of the grid outside the room, as at most four rects"""
+        room = self.in_room(area)
+        if room.width == 0 or room.height == 0:
+            return [area]
+        rects = [Rect(area.left, area.top, area.width, room.top - area.top),
+                 Rect(area.left, room.bottom, area.width, area.bottom - room.bottom),
+                 Rect(area.left, room.top, room.left - area.left, room.height),
+                 Rect(room.right, room.top, area.right - room.right, room.height)]
+        return [rect for rect in rects if rect.width > 0 and rect.height > 0]
+
+    def local_rect(self, area):
+        """Where a rect of the grid is on the board"""
+        return Rect(self.local_pos(area.topleft), (area.width * self.mesh, area.height * self.mesh))
+
+    def cells(self, layer, kind, room):
+        """The grid positions in a rect of the room holding a kind of object on a layer"""
+        xs, ys = np.nonzero(self.index[layer, room.left:room.right, room.top:room.bottom] == kind)
+        return zip((xs + room.left).tolist(), (ys + room.top).tolist())
+
+    def refresh(self):
+        """Bring the board image up to date
+
+        Returns a list of the rects (relative to the board) that changed,
+        or None if the whole board did"""
+        w, h = self.state.w, self.state.h
+        if self.index is None or self.index.shape[1:] != (w, h):
+            self.build_index()
+        else:
+            for pos in self.dirty:
+                self.index_tile(pos)
+        view = (self.state.camx, self.state.camy, tuple(self.layers))
+        old_view, self.view = self.view, view
+        if view != old_view:
+            if old_view is not None and old_view[2] == view[2]:
+                self.scroll(view[0] - old_view[0], view[1] - old_view[1])
+            else:
+                self.dirty.clear()
+                self.draw_area(self.window())
+                return None
+        rects = []
+        board_rect = self.board.get_rect()
+        for pos in self.dirty:
+            rect = Rect(self.local_pos(pos), (self.mesh, self.mesh))
+            if board_rect.colliderect(rect):
+                self.draw_tile(pos, rect)
+                rects.append(rect)
+        self.dirty.clear()
+        if view != old_view:
+            return None
+        return rects
+
+    def scroll(self, dx, dy):
+        """Move the camera by (dx, dy) tiles, drawing only what comes into view"""
+        window = self.window()
+        if abs(dx) >= window.width or abs(dy) >= window.height:
+            self.draw_area(window)
+            return
+        for surf in (self.static, self.board):
+            surf.scroll(-dx * self.mesh, -dy * self.mesh)
+        # The strips that were out of view before
+        if dx > 0:
+            self.draw_area(Rect(window.right - dx, window.top, dx, window.height))
+        elif dx < 0:
+            self.draw_area(Rect(window.left, window.top, -dx, window.height))
+        if dy > 0:
+            self.draw_area(Rect(window.left, window.bottom - dy, window.width, dy))
+        elif dy < 0:
+            self.draw_area(Rect(window.left, window.top, window.width, -dy))
+
+    def draw_area(self, area):
+        """Redraw a rect of the grid from scratch"""
+        self.draw_static(area)
+        self.draw_objects(area)
+
+    def draw_static(self, area):
+        self.static.fill(WHITE, self.local_rect(area))
+        for rect in self.margins(area):
+            self.static.fill(OUT_OF_BOUNDS_COLOR, self.local_rect(rect))
+        objmap = self.state.objmap
+        room = self.in_room(area)
+        blits = []
+        for layer in self.layers:
+            for pos in self.cells(layer, STATIC, room):
+                blits.append((self.atlas.sprite(objmap[pos][layer]), self.local_pos(pos)))
+        self.static.blits(blits, doreturn=False)
+
+    def draw_objects(self, area):
+        rect = self.local_rect(area)
+        self.board.blit(self.static, rect, rect)
+        objmap = self.state.objmap
+        room = self.in_room(area)
+        view = (slice(room.left, room.right), slice(room.top, room.bottom))
+        # Cells where something has been drawn over the static image
+        covered = np.zeros(room.size, dtype=bool)
+        blits = []
+        for layer in self.layers:
+            for pos in self.cells(layer, OBJECT, room):
+                blits.append((self.atlas.sprite(objmap[pos][layer]), self.local_pos(pos)))
+            # Put static objects back on top of what's below them
+            xs, ys = np.nonzero(covered & (self.index[(layer, *view)] == STATIC))
+            for x, y in zip((xs + room.left).tolist(), (ys + room.top).tolist()):
+                dest = self.local_pos((x, y))
+                blits.append((self.static, dest, Rect(dest, (self.mesh, self.mesh))))
+            covered |= self.index[(layer, *view)] == OBJECT
+        self.board.blits(blits, doreturn=False)
+
+    def static_blits(self, pos, dest):
+        """The blits that draw the static objects at pos"""
+        blits = []
+        for layer in self.layers:
+            obj = self.state.objmap[pos][layer]
+            if obj is not None and is_static(obj):
+                blits.append((self.atlas.sprite(obj), dest))
+        return blits
+
+    def object_blits(self, pos, dest):
+        """The blits that draw everything at pos that isn't in the static image"""
+        blits = []
+        covered = False
+        for layer in self.layers:
+            obj = self.state.objmap[pos][layer]
+            if obj is None:
+                continue
+            if not is_static(obj):
+                blits.append((self.atlas.sprite(obj), dest))
+                covered = True
+            elif covered:
+                # Put the static object back on top of what's below it
+                blits.append((self.static, dest, Rect(dest, (self.mesh, self.mesh))))
+        return blits
+
+    def draw_tile(self, pos, rect):
+        if self.state.in_bounds(pos):
+            # The static image of this tile could be stale too (the editor changes walls)
+            self.static.fill(WHITE, rect)
+            self.static.blits(self.static_blits(pos, rect.topleft), doreturn=False)
+        self.board.blit(self.static, rect, rect)
+        if self.state.in_bounds(pos):
+            self.board.blits(self.object_blits(pos, rect.topleft), doreturn=False)
+
+    def draw(self, surf):
+        """Draw whatever changed onto surf, and return the changed rects of surf"""
+        origin = (self.state.padx, self.state.pady)
+        rects = self.refresh()
+        if rects is None:
+            surf.blit(self.board, origin)
+            return [Rect(origin, self.size)]
+        for rect in rects:
+            surf.blit(self.board, rect.move(origin), rect)
+        return [rect.move(origin) for rect in rects]
+
+    def draw_all(self, surf):
+        """Draw the whole board onto surf"""
+        self.refresh()
+        surf.blit(self.board, (self.state.padx, self.state.pady))
+
+
+class Minimap:
+    """A small picture of the whole room, one pixel per spot
+
+    Each layer is kept as an array of indices into a palette of object
+    colors, so the picture is made with a single array blit and a scale."""
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.state = renderer.state
+        # Index 0 is an empty spot
+        self.palette = {}
+        self.colors = np.zeros((256, 3), dtype=np.uint8)
+        self.colors[0] = WHITE
+        self.index = None
+        self.size = (MINIMAP_SIZE, MINIMAP_SIZE)
+        self.small = None
+        self.image = None
+        # The layers in the current image; None means it's out of date
+        self.layers = None
+
+    def resize(self, w, h):
+        self.index = np.zeros((NUM_LAYERS + 1, w, h), dtype=np.uint8)
+        scale = MINIMAP_SIZE / max(w, h, 1)
+        self.size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        self.small = pygame.Surface((max(1, w), max(1, h)))
+        self.layers = None
+
+    def color_index(self, color):
+        if color not in self.palette:
+            if len(self.palette) == len(self.colors) - 1:
+                # Out of room; this is only a preview, so share the last color
+                return len(self.palette)
+            self.palette[color] = len(self.palette) + 1
+            self.colors[self.palette[color]] = color
+        return self.palette[color]
+
+    def set_tile(self, layer, x, y, obj):
+        i = EMPTY if obj is None else self.color_index(obj.color)
+        if self.index[layer, x, y] != i:
+            self.index[layer, x, y] = i
+            self.layers = None
+
+    def stale(self):
+        return self.layers != tuple(self.renderer.layers)
+
+    def compose(self):
+        self.layers = tuple(self.renderer.layers)
+        # The color of each spot is that of its top visible object
+        top = np.zeros(self.index.shape[1:], dtype=np.uint8)
+        for layer in self.layers:
+            top = np.where(self.index[layer] != EMPTY, self.index[layer], top)
+        if top.size:
+            pygame.surfarray.blit_array(self.small, self.colors[top])
+        self.image = pygame.transform.smoothscale(self.small, self.size)
+
+    def draw(self, surf, pos):
+        """Draw the minimap with the camera's view outlined, and return the rect it covers"""
+        if self.stale():
+            self.compose()
+        rect = Rect(pos, self.size)
+        surf.blit(self.image, rect)
+        w, h = self.index.shape[1:]
+        sx, sy = self.size[0] / max(w, 1), self.size[1] / max(h, 1)
+        camera = Rect(pos[0] + round(self.state.camx * sx), pos[1] + round(self.state.camy * sy),
+                      round(self.state.view_w * sx), round(self.state.view_h * sy)).clip(rect)
+        if camera.width and camera.height:
+            pygame.draw.rect(surf, MINIMAP_CAMERA_COLOR, camera, 1)
+        pygame.draw.rect(surf, MINIMAP_BORDER_COLOR, rect, 1)
+        return rect
@@ -39,8 +39,23 @@ class Structure:
         return self.__class__.__name__
 
     def __bytes__(self):
-        attrs = [pack_bytes(getattr(self, attrname), typename)
-                 for attrname, typename in STR_TYPE[self.strtype]["args"]]
+        return self.pack()
+
+    def pack(self, saved=None):
+        """Encode the structure; if saved (a set of object ids) is given,
+        references to objects that aren't being saved are left out
+
+        Returns None if that leaves a reference with nothing to refer to"""
+        attrs = []
+        for attrname, typename in STR_TYPE[self.strtype]["args"]:
+            attr = getattr(self, attrname)
+            if saved is not None and typename == "obj[]":
+                attr = [obj for obj in attr if id(obj) in saved]
+                if not attr:
+                    return None
+            elif saved is not None and typename == "obj" and id(attr) not in saved:
+                return None
+            attrs.append(pack_bytes(attr, typename))
         sizes = [self.strtype, len(attrs)] + [len(x) for x in attrs]
         return bytes(sizes) + b"".join(attrs)
 
@@ -123,28 +138,33 @@ STR_TYPE = {StrType.SWITCH_LINK:
                  "args": [("switches", "obj[]"), ("gates", "obj[]"), ("persistent", "bool")]}}
 
 
-def load_str_from_data(state, strtype, attrs):
+def load_str_from_data(state, strtype, attrs, objtable):
+    """Build a structure from its saved attributes
+
+    Objects are referred to by their index in the room's object table"""
     arg_types = STR_TYPE[strtype]["args"]
-    args = [unpack_bytes(attrs[i], state.objmap, arg_types[i][1]) for i in range(len(attrs))]
+    args = [unpack_bytes(attrs[i], objtable, arg_types[i][1]) for i in range(len(attrs))]
     return STR_TYPE[strtype]["type"](state, *args)
 
 
+# IF NOT BIGMAP
+# Object IDs take 3 bytes, enough for every spot on every layer of a full room
 DATA_SIZE = {"bool": 1,
              "color": 3,
              "obj": 3}
 
 
-def unpack_bytes(data, map, typename):
+def unpack_bytes(data, objs, typename):
     if typename == "bool":
         return bool(data[0])
     elif typename == "color":
         return tuple(data)
     elif typename == "obj":
-        return map[(data[0], data[1])][data[2]]
+        return objs[int.from_bytes(data, byteorder="little")]
     elif typename[-2:] == "[]":
         element_type = typename[:-2]
         size = DATA_SIZE[element_type]
-        return [unpack_bytes(data[size*i + 1 : size*(i+1) + 1], map, element_type) for i in range(data[0])]
+        return [unpack_bytes(data[size*i + 1 : size*(i+1) + 1], objs, element_type) for i in range(data[0])]
     elif typename == "string":
         return data[1:].decode()
 
@@ -155,7 +175,7 @@ def pack_bytes(attr, typename):
     elif typename == "color":
         return bytes(attr)
     elif typename == "obj":
-        return bytes([*attr.pos, attr.layer])
+        return attr.id.to_bytes(DATA_SIZE["obj"], byteorder="little")
     if typename[-2:] == "[]":
         return bytes([len(attr)]) + b"".join(pack_bytes(x, typename[:-2]) for x in attr)
     elif typename == "string":
@@ -1,55 +1,144 @@
 import sys
+import time
 from tkinter import messagebox
 
 import pygame
 
+from frame_stats import FrameStats, StatsOverlay
 from game_constants import *
 from gs.start_menu import GSStartMenu
+from state_profiler import StateProfiler
 
 class StateManager:
+    # root is the tk window the game is embedded in, or None when running headless
     def __init__(self, root):
         self.state = None
         self.pause_timer = 0
         self.root = root
         self.quit = False
+        # The window, which every state draws to
+        self.surf = pygame.display.set_mode((WINDOW_WIDTH, WINDOW_HEIGHT), pygame.HWSURFACE | pygame.DOUBLEBUF)
+        # When the current state started changing, until the new one is drawn
+        self.switch_start = None
+        # How long the last change of state took to show up, in ms
+        self.switch_time = 0
+        # How long each part of the last few frames took
+        self.stats = FrameStats()
+        self.overlay = StatsOverlay(self.stats)
+        self.profiler = StateProfiler()
         # This may change eventually, but most games start on a menu
         GSStartMenu(self)
 
     def update(self):
-        self.check_for_quit()
+        self.profiler.enable(self.state)
+        # The queue is emptied once a frame, and the events are handed along from here
+        events = pygame.event.get()
+        # Any input at all might change what's on screen
+        if events:
+            self.state.mark_dirty()
+        events = self.check_for_quit(events)
+        self.stats.lap("check_for_quit")
         # If there's anything to do before input, do it now
         self.state.pre_update()
+        self.stats.lap("pre_update")
         # Input handling should finish executing as quickly as possible, so as to not drop input
-        self.state.handle_input()
-        pygame.event.clear()
+        self.state.handle_input(events)
+        self.stats.lap("handle_input")
         # All of the "work" should go in update()
         self.state.update()
+        self.profiler.disable()
+        self.stats.lap("update")
 
     def draw(self):
-        self.state.draw()
-
-    def check_for_quit(self):
-        """Check the event queue for something trying to quit the program."""
-        for event in pygame.event.get(QUIT):
-            self.ask_quit()
-        # Escape key just returns up one state
-        for event in pygame.event.get(KEYDOWN):
-            if event.key == K_ESCAPE:
+        """Draw the current state, returning the rects of the window that changed
+        (or None, if the whole window should be updated)
+
+        If nothing has changed since the last frame, nothing is drawn"""
+        self.profiler.enable(self.state)
+        switched = self.switch_start is not None
+        if not switched and not self.state.dirty and not self.state.animated():
+            rects = []
+        else:
+            self.state.dirty = False
+            rects = self.state.draw()
+            if switched:
+                self.switch_time = 1000 * (time.perf_counter() - self.switch_start)
+                self.switch_start = None
+                if DEBUG and self.switch_time > FRAME_TIME:
+                    print(f"Switching to {type(self.state).__name__} took {self.switch_time:.1f}ms")
+                # The window was showing a different state until now
+                rects = None
+        overlay_rect = self.overlay.draw(self.surf, self.state, rects is None or bool(rects))
+        if overlay_rect is not None and rects is not None:
+            rects = rects + [overlay_rect]
+        self.profiler.disable()
+        self.stats.lap("draw")
+        return rects
+
+    def present(self, rects):
+        """Show the parts of the window that draw() said had changed"""
+        if rects is None:
+            pygame.display.update()
+        elif rects:
+            pygame.display.update(rects)
+        # The overlay is only drawn over the frame that's being shown
+        self.overlay.restore(self.surf)
+        self.stats.lap("display")
+
+    def start_switch(self):
+        """The current state is about to change; time how long until the new one is drawn"""
+        if self.switch_start is None:
+            self.switch_start = time.perf_counter()
+
+    def check_for_quit(self, events):
+        """Handle the events meant for the whole program, like quitting
+
+        Returns the rest of the events, which are for the current state.
+        If one of them switches states, the rest of them are dropped, since
+        they were meant for the state that was just left."""
+        state = self.state
+        unused = []
+        for event in events:
+            if event.type == QUIT:
+                self.ask_quit()
+            elif event.type != KEYDOWN:
+                unused.append(event)
+            # Escape key just returns up one state
+            elif event.key == K_ESCAPE:
                 self.state.previous_state()
-            # If it wasn't the escape key, put that event back in the event queue
-            pygame.event.post(event)
+            elif event.key == STATS_OVERLAY_KEY:
+                self.overlay.toggle()
+            elif event.key == STATS_EXPORT_KEY:
+                print(f"Wrote frame timings to {self.stats.export()}")
+            elif event.key == PROFILE_KEY:
+                self.profiler.toggle()
+            else:
+                unused.append(event)
+            if self.state is not state:
+                return []
+        return unused
 
     def ask_quit(self):
-        if messagebox.askokcancel("Quit", "Are you sure you want to Quit?"):
+        # Without a window there's nobody to ask
+        if self.root is None:
+            self.quit = True
+        elif messagebox.askokcancel("Quit", "Are you sure you want to Quit?"):
             self.quit = True
         else:
             self.quit = False
 
     def terminate(self):
         """Safely quit pygame."""
+        # Don't lose a profile that was still being recorded
+        if self.profiler.running:
+            self.profiler.stop()
         # This ensures that the quit function of every GameState
         # on the stack is called
         self.state.top_state()
+        # The top state is never quit, since it has no parent to go back to
+        if self.state.root.bg is not None:
+            self.state.root.bg.stop()
         pygame.quit()
-        self.root.destroy()
+        if self.root is not None:
+            self.root.destroy()
         sys.exit()
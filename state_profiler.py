@@ -0,0 +1,80 @@
+"""Profiling the game while it runs, one profile for each kind of state"""
+
+import cProfile
+import io
+import os
+import pstats
+import time
+
+from game_constants import *
+
+
+class StateProfiler:
+    """Runs cProfile over the state manager's updates and draws, while turned on
+
+    Time is counted against whichever state was in control when the update
+    or draw started.  When profiling stops, each state that ran gets a .prof
+    file (which pstats and snakeviz can read) and a .txt summary of the
+    PROFILE_TOP functions it spent the most time in."""
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.running = False
+        # A profile for each kind of state, by class name
+        self.profiles = {}
+        self.active = None
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        self.running = True
+        self.profiles = {}
+        print("Profiling started")
+
+    def stop(self):
+        """Stop profiling, write out everything recorded, and return the files' names"""
+        self.disable()
+        self.running = False
+        files = self.dump()
+        self.profiles = {}
+        print(f"Profiling stopped; wrote {', '.join(files) or 'nothing'}")
+        return files
+
+    def enable(self, state):
+        if not self.running:
+            return
+        name = type(state).__name__
+        if name not in self.profiles:
+            self.profiles[name] = cProfile.Profile()
+        self.active = self.profiles[name]
+        self.active.enable()
+
+    def disable(self):
+        if self.active is not None:
+            self.active.disable()
+            self.active = None
+
+    def dump(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        files = []
+        for name, profile in self.profiles.items():
+            base = os.path.join(self.directory, f"{stamp}_{name}")
+            profile.dump_stats(base + ".prof")
+            with open(base + ".txt", "w") as file:
+                file.write(summary(profile))
+            files.append(base + ".prof")
+        return files
+
+
+def summary(profile, top=PROFILE_TOP):
+    """The functions a profile spent the most time in, by total and by cumulative time"""
+    out = io.StringIO()
+    stats = pstats.Stats(profile, stream=out)
+    stats.strip_dirs()
+    for key in ("tottime", "cumulative"):
+        stats.sort_stats(key).print_stats(top)
+    return out.getvalue()
@@ -0,0 +1,184 @@
+"""Render PNG previews of Sokoban maps, without opening them in the editor
+
+Usage: python thumbnails.py [directory or files...] [-o DIR] [-j JOBS] [-f]
+
+For each map this writes <map name>.png, a picture of the whole room, and
+<map name>.thumb.png, a small version of it.  Maps are named by their path
+relative to the directory all of the maps are in, so maps from different
+directories get previews in matching subdirectories of the output.  Maps
+are drawn in a pool of worker processes with no window.  The size, mtime
+and hash of each map are kept in the output directory, so maps which
+haven't changed aren't read or drawn again."""
+
+import argparse
+import hashlib
+import io
+import os
+import sys
+
+# Nothing gets shown, here or in the workers
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+from game_constants import MAIN_DIR, MAPS_DIR, WHITE, ZOOM_MESHES
+from sokoban_map import decode_map, find_maps, pool_map, write_atomic
+from sokoban_obj import Layer, OBJ_TYPE, Player
+from sokoban_render import get_atlas
+
+# Not in the maps directory, where the editor's file dialogs would show them
+PREVIEW_DIR = os.path.join(MAIN_DIR, "previews")
+# Holds a line of "<hash> <mtime> <size> <map name>" for every preview in the directory
+PREVIEW_CACHE_FILE = "previews.cache"
+# Previews use the largest spot size that keeps them within this many pixels
+PREVIEW_MAX_SIZE = 2048
+THUMB_SIZE = 128
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def preview_files(outdir, name):
+    return os.path.join(outdir, name + ".png"), os.path.join(outdir, name + ".thumb.png")
+
+
+def map_names(files):
+    """Return a dict of each map file to its name: its path relative to the
+    directory that all of the maps are in"""
+    paths = [os.path.abspath(filename) for filename in files]
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    except ValueError:
+        # On different drives, so the full paths are the only unique names
+        return {filename: os.path.splitdrive(path)[1].lstrip(os.sep) for filename, path in zip(files, paths)}
+    return {filename: os.path.relpath(path, root) for filename, path in zip(files, paths)}
+
+
+def render_map(room):
+    """Draw a MapData the way the game shows it, with the player at its start"""
+    longest = max(room.w, room.h, 1)
+    mesh = next((mesh for mesh in ZOOM_MESHES if mesh * longest <= PREVIEW_MAX_SIZE), ZOOM_MESHES[-1])
+    atlas = get_atlas(mesh)
+    objs = {}
+    for name, args, pos in room.objs:
+        obj = OBJ_TYPE[name]["type"](None, pos, *args)
+        objs[(pos, obj.layer)] = obj
+    objs[(room.player_pos, Layer.PLAYER)] = Player(None, room.player_pos)
+    surf = pygame.Surface((max(1, room.w * mesh), max(1, room.h * mesh)))
+    surf.fill(WHITE)
+    # Lower layers first, so that what's on top is drawn on top
+    surf.blits([(atlas.sprite(obj), (pos[0] * mesh, pos[1] * mesh))
+                for (pos, layer), obj in sorted(objs.items(), key=lambda item: item[0][1])],
+               doreturn=False)
+    return surf
+
+
+def thumbnail(surf):
+    w, h = surf.get_size()
+    scale = THUMB_SIZE / max(w, h)
+    return pygame.transform.smoothscale(surf, (max(1, round(w * scale)), max(1, round(h * scale))))
+
+
+def png_bytes(surf):
+    file = io.BytesIO()
+    pygame.image.save(surf, file, "png")
+    return file.getvalue()
+
+
+def render_job(job):
+    filename, name, data, outdir = job
+    try:
+        preview = render_map(decode_map(data))
+        preview_file, thumb_file = preview_files(outdir, name)
+        os.makedirs(os.path.dirname(preview_file), exist_ok=True)
+        write_atomic(preview_file, png_bytes(preview))
+        write_atomic(thumb_file, png_bytes(thumbnail(preview)))
+    except (ValueError, IndexError, KeyError, OSError, pygame.error) as e:
+        return filename, e
+    return filename, None
+
+
+def read_cache(outdir):
+    """Return a dict of map name to the (hash, mtime, size) its previews were made from"""
+    cache = {}
+    try:
+        with open(os.path.join(outdir, PREVIEW_CACHE_FILE)) as file:
+            for line in file:
+                try:
+                    digest, mtime, size, name = line.rstrip("\n").split(" ", 3)
+                    cache[name] = (digest, int(mtime), int(size))
+                except ValueError:
+                    # Left by an older version, so that map is just drawn again
+                    continue
+    except IOError:
+        pass
+    return cache
+
+
+def write_cache(outdir, cache):
+    lines = "".join(f"{digest} {mtime} {size} {name}\n" for name, (digest, mtime, size) in sorted(cache.items()))
+    write_atomic(os.path.join(outdir, PREVIEW_CACHE_FILE), lines.encode())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render previews of Sokoban maps")
+    parser.add_argument("paths", nargs="*", default=[MAPS_DIR],
+                        help="map files or directories of maps (default: the maps directory)")
+    parser.add_argument("-o", "--output", default=PREVIEW_DIR,
+                        help="directory to write previews to (default: previews)")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="redraw every map, even ones that haven't changed")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output, exist_ok=True)
+    cache = {} if args.force else read_cache(args.output)
+    files = find_maps(args.paths)
+    names = map_names(files)
+    jobs = []
+    # What each map's entry in the cache will be, once its previews are drawn
+    entries = {}
+    unchanged = 0
+    failed = 0
+    for filename in files:
+        name = names[filename]
+        try:
+            stat = os.stat(filename)
+            cached = cache.get(name)
+            exists = all(map(os.path.exists, preview_files(args.output, name)))
+            if exists and cached is not None and cached[1:] == (stat.st_mtime_ns, stat.st_size):
+                unchanged += 1
+                continue
+            with open(filename, "rb") as file:
+                data = file.read()
+        except IOError as e:
+            print(f"{filename}: {e}")
+            failed += 1
+            continue
+        entries[name] = (content_hash(data), stat.st_mtime_ns, stat.st_size)
+        if exists and cached is not None and cached[0] == entries[name][0]:
+            # Touched, but not changed
+            cache[name] = entries[name]
+            unchanged += 1
+            continue
+        cache.pop(name, None)
+        jobs.append((filename, name, data, args.output))
+
+    drawn = 0
+    if jobs:
+        for filename, error in pool_map(render_job, jobs, args.jobs):
+            if error is None:
+                cache[names[filename]] = entries[names[filename]]
+                drawn += 1
+            else:
+                print(f"{filename}: {error}")
+                failed += 1
+    write_cache(args.output, cache)
+    print(f"Drew {drawn} maps, {unchanged} unchanged, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,8 @@
 
 import pygame
 
-from background import BGSolid
+from background import BGSolid, BGThreaded
+from font import render_text
 from game_constants import *
 
 
@@ -10,9 +11,18 @@ class Widget:
     """A very generic GUI element"""
     def __init__(self, pos):
         self.pos = pos
+        # Whether the widget looks different than when it was last drawn
+        self.dirty = True
 
-    def handle_input(self):
-        pass
+    def mark_dirty(self):
+        self.dirty = True
+
+    def changed(self):
+        return self.dirty
+
+    def handle_event(self, event):
+        """Respond to an event, returning True if it was used up"""
+        return False
 
     def update(self):
         pass
@@ -22,7 +32,10 @@ class Widget:
 
 
 class Panel(Widget):
-    """A rectangular widget which contains relatively placed child widgets"""
+    """A rectangular widget which contains relatively placed child widgets
+
+    The panel keeps its children drawn on its own surface, and only draws
+    them again when one of them has changed (or the background is animated)"""
     def __init__(self, dims, pos):
         super().__init__(pos)
         self.bg = None
@@ -31,45 +44,85 @@ class Panel(Widget):
         self.focus = None  # Does one child have the focus?
         self.dim_filter = pygame.Surface(dims, flags=SRCALPHA)
         self.dim_filter.fill(DIM_FILTER)
+        # Whether the surfaces have been converted to the display's format
+        self.converted = False
 
     def add(self, child):
         """Add a child widget with a relative position"""
         self.children.append(child)
+        self.dirty = True
 
     def remove(self, child):
         try:
             self.children.remove(child)
-        except KeyError:
+            self.dirty = True
+        except ValueError:
             print("Attempted to remove a nonexistent widget")
 
     def set_color(self, color):
-        self.bg = BGSolid(color)
+        self.set_bg(BGSolid(color))
 
-    def set_bg(self, bg):
+    def set_bg(self, bg, threaded=False):
+        """Use a new background; if threaded, it's animated on a worker thread"""
+        if self.bg is not None:
+            self.bg.stop()
+        if threaded:
+            bg = BGThreaded(bg, self.surf.get_size())
         self.bg = bg
+        self.dirty = True
+
+    def animated(self):
+        return self.bg is not None and self.bg.animated
+
+    def changed(self):
+        return self.dirty or self.animated() or any(child.changed() for child in self.children)
 
     def set_focus(self, child=None):
         if child is not None and child not in self.children:
             self.add(child)
         self.focus = child
+        self.dirty = True
 
-    def handle_input(self):
-        if self.focus is None:
-            for child in self.children:
-                child.handle_input()
+    def convert(self):
+        """Match the display's pixel format, so blitting the panel is fast"""
+        if pygame.display.get_surface() is None:
+            return
+        # A panel with a background covers everything behind it
+        if self.bg is not None:
+            self.surf = self.surf.convert()
         else:
-            self.focus.handle_input()
+            self.surf = self.surf.convert_alpha()
+        self.dim_filter = self.dim_filter.convert_alpha()
+        self.converted = True
+
+    def handle_event(self, event):
+        """Offer the event to the focused child, or else to each child in turn until one uses it"""
+        if self.focus is None:
+            return any(child.handle_event(event) for child in self.children)
+        return self.focus.handle_event(event)
 
     # A panel has no behavior, so it just updates its children
     def update(self):
-        self.bg.update()
+        if self.bg is not None:
+            self.bg.update()
         for child in self.children:
             child.update()
 
     def draw(self, surf):
+        if self.changed():
+            self.compose()
+        # Draw this panel onto the surface we were given
+        surf.blit(self.surf, self.pos)
+
+    def compose(self):
+        """Draw the background and children onto the panel's own surface"""
+        if not self.converted:
+            self.convert()
         # First fill the panel's surface with its background color
         if self.bg is not None:
             self.bg.draw(self.surf)
+        else:
+            self.surf.fill((0, 0, 0, 0))
         # Now draw all of its child objects on top
         if self.focus is None:
             for child in self.children:
@@ -80,8 +133,7 @@ class Panel(Widget):
                     child.draw(self.surf)
             self.surf.blit(self.dim_filter, (0,0))
             self.focus.draw(self.surf)
-        # When we're done, draw this panel onto the surface we were given
-        surf.blit(self.surf, self.pos)
+        self.dirty = False
 
 
 class Root(Panel):
@@ -103,47 +155,61 @@ class Menu(Widget):
         self.color_def = None   # Default text color
         self.color_high = None  # Highlighted text color
         self.font = None
+        # The rendered items, or None if they've changed since the last draw
+        self.rendered = None
 
     def add_item(self, name, method):
         """Add an item 'name' to the menu,
         which calls self.parent.method() when activated"""
         self.items.append({"name": name, "method": method})
+        self.rendered = None
 
-    def handle_input(self):
+    def handle_event(self, event):
         """Check for menu movement or activation"""
-        for event in pygame.event.get(KEYDOWN):
-            if event.key == K_UP:
-                self.prev()
-            if event.key == K_DOWN:
-                self.next()
-            # This is slightly magic
-            if event.key == K_RETURN:
-                # By default, we're calling a method of self.parent
-                caller = self.parent
-                # But we might have to go through some attributes first, separated by periods
-                for attr in self.items[self.index]["method"].split("."):
-                    caller = getattr(caller, attr)
-                caller()
-            pygame.event.post(event)
+        if event.type != KEYDOWN:
+            return False
+        if event.key == K_UP:
+            self.prev()
+        elif event.key == K_DOWN:
+            self.next()
+        # This is slightly magic
+        elif event.key == K_RETURN:
+            # By default, we're calling a method of self.parent
+            caller = self.parent
+            # But we might have to go through some attributes first, separated by periods
+            for attr in self.items[self.index]["method"].split("."):
+                caller = getattr(caller, attr)
+            caller()
+        else:
+            return False
+        return True
 
     def next(self):
         """Move the menu cursor forward"""
         self.index = (self.index + 1) % len(self.items)
+        self.rendered = None
 
     def prev(self):
         """Move the menu cursor backward"""
         self.index = (self.index + len(self.items) - 1) % len(self.items)
+        self.rendered = None
+
+    def changed(self):
+        return self.rendered is None
+
+    def render(self):
+        self.rendered = [render_text(self.font, item["name"],
+                                     self.color_high if i == self.index else self.color_def)
+                         for i, item in enumerate(self.items)]
 
     # As it is, menu text is always left aligned and fixed size/spacing
     def draw(self, surf):
         """Draw the menu on a surface at the given (relative) position"""
+        if self.rendered is None:
+            self.render()
         x, y = self.pos
-        for i in range(len(self.items)):
-
-            if i == self.index:
-                surf.blit(self.font.render(self.items[i]["name"], True, self.color_high), (x, y + self.height * i))
-            else:
-                surf.blit(self.font.render(self.items[i]["name"], True, self.color_def), (x, y + self.height * i))
+        surf.blits([(line, (x, y + self.height * i)) for i, line in enumerate(self.rendered)],
+                   doreturn=False)
 
 # Should this class be reconciled with Menu somehow...?
 class TextLines:
@@ -155,21 +221,27 @@ class TextLines:
         self.height = 0
         self.color = None
         self.font = None
+        # The rendered lines, or None if they've changed since the last draw
+        self.rendered = None
 
     def add_line(self, line):
         self.lines.append(line)
+        self.rendered = None
 
     # If you have a line which changes depending on variables, use this to redefine it
     # Could there be a better way?
     # Consider: a line has a list of (object, attribute) pairs, and we call format() using these in draw()
     def set_line(self, index, line):
-        if index in range(len(self.lines)):
+        if index in range(len(self.lines)) and self.lines[index] != line:
             self.lines[index] = line
+            self.rendered = None
 
     def draw(self, surf, pos):
+        if self.rendered is None:
+            self.rendered = [render_text(self.font, line, self.color) for line in self.lines]
         x, y = pos
-        for i in range(len(self.lines)):
-            surf.blit(self.font.render(self.lines[i], True, self.color), (x, y + self.height * i))
+        surf.blits([(line, (x, y + self.height * i)) for i, line in enumerate(self.rendered)],
+                   doreturn=False)
 
 # We'll keep this one really simple at first: the cursor only goes at the end of the current text
 # Note to self: Use pygame.key.get_mods() to check for ctrl, so we can enable pasting
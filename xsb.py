@@ -0,0 +1,215 @@
+"""Convert between .map files and the standard XSB text notation for Sokoban
+
+Usage:
+    python xsb.py import COLLECTION.txt [-o DIR] [-j JOBS]
+    python xsb.py export [MAPS...] [-o COLLECTION.txt] [-j JOBS]
+
+A collection is read one level at a time and the levels are converted in a
+pool of worker processes, so collections with thousands of levels convert
+in a single pass without being held in memory all at once.
+
+Our player doesn't push anything by itself: it walks over solid objects,
+and only a rideable box it's sitting on (a car) moves things.  So an
+imported player starts riding a car, and the car does the pushing.  This
+plays like Sokoban with two differences: a car can push a whole row of
+boxes, not just one, and a car parked on a goal holds that goal down too."""
+
+import argparse
+import os
+import sys
+
+from game_constants import ColorEnum, MAPS_DIR
+from sokoban_map import MapSnapshot, decode_map, encode_map, find_maps, group_objs, pool_map, write_atomic
+from sokoban_obj import Layer, OBJ_TYPE, pack_obj
+
+# XSB has no colors, so everything gets a fixed one.
+# Boxes aren't sticky, so they don't join up when they touch,
+# and goals become switches (a box on a switch holds it down)
+WALL = ("Wall", (ColorEnum.Black.value,))
+BOX = ("Box", (ColorEnum.Red.value, False, False))
+GOAL = ("Switch", (ColorEnum.SwRed.value,))
+PLAYER = ("Player", (ColorEnum.Grey.value,))
+# The box the player rides, which does its pushing
+CAR = ("Box", (ColorEnum.Blue.value, False, True))
+
+XSB_OBJS = {"#": [WALL],
+            "$": [BOX],
+            ".": [GOAL],
+            "*": [GOAL, BOX],
+            "@": [CAR, PLAYER],
+            "+": [GOAL, CAR, PLAYER],
+            "p": [CAR, PLAYER],
+            "P": [GOAL, CAR, PLAYER],
+            "b": [BOX],
+            "B": [GOAL, BOX]}
+XSB_FLOOR = " -_"
+XSB_CHARS = set(XSB_OBJS) | set(XSB_FLOOR)
+
+# IF NOT BIGMAP
+MAX_SIZE = 255
+
+CHUNK_SIZE = 64
+
+
+def expand_rle(line):
+    """Undo run-length encoding ("3#" is "###"), splitting rows on '|'"""
+    rows = [[]]
+    count = ""
+    for c in line:
+        if c.isdigit():
+            count += c
+        elif c == "|":
+            rows.append([])
+        else:
+            rows[-1].append(c * int(count or 1))
+            count = ""
+    return ["".join(row) for row in rows]
+
+
+def is_board_line(line):
+    line = line.rstrip("\r\n")
+    return "#" in line and all(c in XSB_CHARS or c.isdigit() or c == "|" for c in line)
+
+
+def read_levels(lines):
+    """Yield the rows of each level in a collection, in order"""
+    rows = []
+    for line in lines:
+        if is_board_line(line):
+            rows.extend(expand_rle(line.rstrip("\r\n")))
+        elif rows:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+def xsb_to_snapshot(rows):
+    """Build a MapSnapshot from the rows of an XSB level"""
+    w = max(len(row) for row in rows)
+    h = len(rows)
+    if w > MAX_SIZE or h > MAX_SIZE:
+        raise ValueError(f"{w}x{h} is too big for a map")
+    objs = []
+    player_pos = None
+    for y, row in enumerate(rows):
+        for x, c in enumerate(row):
+            if c in XSB_FLOOR:
+                continue
+            if c not in XSB_OBJS:
+                raise ValueError(f"Unknown character {c!r}")
+            for name, args in XSB_OBJS[c]:
+                objs.append((name, args, (x, y)))
+                if name == "Player":
+                    if player_pos is not None:
+                        raise ValueError("More than one player")
+                    player_pos = (x, y)
+    if player_pos is None:
+        raise ValueError("No player")
+    objs = group_objs(objs, key=lambda obj: pack_obj(obj[0], obj[1]))
+    return MapSnapshot(w, h, objs, player_pos, [])
+
+
+def map_to_xsb(data):
+    """Turn a MapData into rows of XSB; objects XSB can't show are left out"""
+    layers = {}
+    for name, args, pos in data.objs:
+        layers.setdefault(pos, {})[OBJ_TYPE[name]["layer"]] = name
+    layers.setdefault(data.player_pos, {})[Layer.PLAYER] = "Player"
+    rows = []
+    for y in range(data.h):
+        row = []
+        for x in range(data.w):
+            cell = layers.get((x, y), {})
+            solid = cell.get(Layer.SOLID)
+            goal = cell.get(Layer.FLOOR) == "Switch"
+            if solid in ["Wall", "GateWall"]:
+                row.append("#")
+            elif cell.get(Layer.PLAYER) == "Player":
+                row.append("+" if goal else "@")
+            elif solid == "Box":
+                row.append("*" if goal else "$")
+            else:
+                row.append("." if goal else " ")
+        rows.append("".join(row).rstrip())
+    return rows
+
+
+def import_level(job):
+    rows, filename = job
+    try:
+        write_atomic(filename, encode_map(xsb_to_snapshot(rows)))
+    except (ValueError, OSError) as e:
+        return filename, e
+    return filename, None
+
+
+def export_map(filename):
+    try:
+        with open(filename, "rb") as file:
+            return filename, map_to_xsb(decode_map(file.read())), None
+    except (ValueError, IndexError, OSError) as e:
+        return filename, None, e
+
+
+def import_collection(collection, outdir, jobs=None):
+    """Write every level of an XSB collection to outdir as a .map"""
+    os.makedirs(outdir, exist_ok=True)
+    prefix = os.path.splitext(os.path.basename(collection))[0]
+    converted = failed = 0
+    with open(collection, encoding="utf-8", errors="replace") as file:
+        levels = ((rows, os.path.join(outdir, f"{prefix}_{i:05d}.map"))
+                  for i, rows in enumerate(read_levels(file), 1))
+        for filename, error in pool_map(import_level, levels, jobs, CHUNK_SIZE, ordered=False):
+            if error is None:
+                converted += 1
+            else:
+                failed += 1
+                print(f"{filename}: {error}")
+    print(f"Imported {converted} levels, {failed} failed")
+    return failed == 0
+
+
+def export_collection(files, output, jobs=None):
+    """Write the given maps to output as one XSB collection, in order"""
+    exported = failed = 0
+    with open(output, "w", encoding="utf-8") as out:
+        for filename, rows, error in pool_map(export_map, files, jobs, CHUNK_SIZE):
+            if error is None:
+                out.write(f"; {os.path.basename(filename)}\n\n")
+                out.write("\n".join(rows) + "\n\n")
+                exported += 1
+            else:
+                failed += 1
+                print(f"{filename}: {error}")
+    print(f"Exported {exported} levels, {failed} failed")
+    return failed == 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert between .map files and XSB")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    importer = commands.add_parser("import", parents=[common],
+                                   help="split an XSB collection into .map files")
+    importer.add_argument("collection")
+    importer.add_argument("-o", "--output", default=MAPS_DIR,
+                          help="directory to write maps to (default: the maps directory)")
+    exporter = commands.add_parser("export", parents=[common],
+                                   help="write .map files out as one XSB collection")
+    exporter.add_argument("maps", nargs="*", default=[MAPS_DIR],
+                          help="map files or directories of maps (default: the maps directory)")
+    exporter.add_argument("-o", "--output", default="collection.xsb")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        ok = import_collection(args.collection, args.output, args.jobs)
+    else:
+        ok = export_collection(find_maps(args.maps), args.output, args.jobs)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())